@@ -0,0 +1,168 @@
+import sys
+import argparse
+import hashlib
+import tempfile
+import unittest
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import file_processor
+from constants import Col, Tier, tier_ranks
+
+# 기관 annotation TSV (ClinVar/OncoKB 등에서 만든 파일)를 정렬된 hash 배열로 컴파일해
+# blacklist.xlsx와 같은 위치에 annotation_index.json, .keys.npy, .tiers.npy로 저장
+# - 원본 TSV 칼럼: type(SNV/CNV/Fusion), gene, change, tier(I, I/II, III, ...)
+# - change: SNV는 Nucleotide_change 또는 AA_Change(Ter 대신 *), CNV는 Call(AMP/DEL),
+#   Fusion은 ID의 fusion 이름(EML4-ALK), 비어 있으면 유전자 단위 규칙
+# - 같은 키가 여러 번 나오면 뒤에 나온 행이 우선
+# 케이스마다 np.load(mmap_mode='r')로 열어 여러 worker 프로세스가 같은 페이지를 공유
+INDEX_FILE_NAME = 'annotation_index.json'
+FORMAT_VERSION = 1
+HASH_KEY = 'oncomine-annot-1' # pandas hash_array용 16바이트 키 (바꾸면 다시 컴파일해야 함)
+CHUNKSIZE = 1_000_000
+
+
+def _hash_keys(variant_type, gene: pd.Series, change: pd.Series) -> np.ndarray:
+    change = change.astype(object).where(change.notna(), '') # categorical 칼럼 포함
+    keys = variant_type + '\t' + gene.astype(str) + '\t' + change.astype(str)
+    return pd.util.hash_array(keys.to_numpy(object), hash_key=HASH_KEY, categorize=False)
+
+
+def _fusion_name(df: pd.DataFrame) -> pd.Series:
+    return df[Col.ID].str.split('.', n=1).str[0]
+
+
+# variant 단위 키 (우선순위 낮은 것부터), 유전자 단위 키는 그보다 낮음
+variant_changes = {
+    'SNV': (Col.GENE_NAME, lambda df: [df[Col.AA_CHANGE], df[Col.NUCLEOTIDE_CHANGE]]),
+    'CNV': (Col.GENE_NAME, lambda df: [df[Col.CALL]]),
+    'Fusion': (Col.GENE, lambda df: [_fusion_name(df)]),
+}
+
+
+def compile_index(source_file: Path, index_file: Path):
+    tier_codes = {x.value: tier_ranks[x] for x in Tier}
+    hashes, tiers = [], []
+    with open(source_file, 'rt', encoding='utf-8') as f:
+        for chunk in pd.read_table(f, usecols=['type', 'gene', 'change', 'tier'], dtype=str,
+                                   keep_default_na=False, chunksize=CHUNKSIZE):
+            unknown_types = set(chunk['type']) - set(variant_changes)
+            unknown_tiers = set(chunk['tier']) - set(tier_codes)
+            if unknown_types or unknown_tiers:
+                raise ValueError(f'Unknown type {sorted(unknown_types)} or tier'
+                                 f' {sorted(unknown_tiers)} in {source_file}')
+            hashes.append(_hash_keys(chunk['type'], chunk['gene'], chunk['change']))
+            tiers.append(chunk['tier'].map(tier_codes).to_numpy(np.int8))
+    hashes = np.concatenate(hashes) if hashes else np.empty(0, np.uint64)
+    tiers = np.concatenate(tiers) if tiers else np.empty(0, np.int8)
+
+    # 같은 키는 마지막 행만 남김
+    order = np.argsort(hashes[::-1], kind='stable')
+    hashes, tiers = hashes[::-1][order], tiers[::-1][order]
+    unique = np.ones(len(hashes), dtype=bool)
+    unique[1:] = hashes[1:] != hashes[:-1]
+    hashes, tiers = hashes[unique], tiers[unique]
+
+    np.save(index_file.with_suffix('.keys.npy'), hashes)
+    np.save(index_file.with_suffix('.tiers.npy'), tiers)
+    digest = hashlib.sha256()
+    with open(source_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    # 다른 파일보다 마지막에 써서 케이스 캐시 키(이 파일의 hash)가 완성된 인덱스를 가리키게 함
+    file_processor.write_json_atomic(index_file, {
+        'format': FORMAT_VERSION, 'hash_key': HASH_KEY, 'source': source_file.name,
+        'source_sha256': digest.hexdigest(), 'entries': len(hashes)}, strict=True)
+    print(f'Compiled annotation index: {index_file} ({len(hashes)} keys)')
+    return len(hashes)
+
+
+class AnnotationIndex:
+    def __init__(self, index_file: Path):
+        meta = file_processor.read_json(index_file)
+        if meta is None or meta.get('format') != FORMAT_VERSION or \
+                meta.get('hash_key') != HASH_KEY:
+            raise ValueError(f'Incompatible annotation index, compile it again: {index_file}')
+        self.index_file = index_file
+        self.keys = np.load(index_file.with_suffix('.keys.npy'), mmap_mode='r')
+        self.tiers = np.load(index_file.with_suffix('.tiers.npy'), mmap_mode='r')
+        print(f'Loaded annotation index: {index_file} ({len(self.keys)} keys)')
+
+    # 찾은 tier의 code, 없으면 -1
+    def lookup(self, variant_type: str, gene: pd.Series, change: pd.Series) -> np.ndarray:
+        hashes = _hash_keys(variant_type, gene, change)
+        if len(self.keys) == 0:
+            return np.full(len(hashes), -1, dtype=np.int8)
+        position = np.minimum(np.searchsorted(self.keys, hashes), len(self.keys) - 1)
+        return np.where(self.keys[position] == hashes, self.tiers[position], -1).astype(np.int8)
+
+    # 유전자 단위 annotation은 규칙으로 tier가 정해지지 않은(N/A) 행만 채우고,
+    # variant 단위 annotation은 규칙으로 정한 tier를 덮어씀
+    # final 규칙(품질, benign, artifact)으로 정한 행은 바꾸지 않음
+    def apply(self, variant_type: str, df: pd.DataFrame, tiers: pd.Categorical,
+              final: np.ndarray = None):
+        gene_column, changes = variant_changes[variant_type]
+        gene = df[gene_column]
+        codes = tiers.codes.copy()
+        keep = np.zeros(len(df), dtype=bool) if final is None else final
+        found = self.lookup(variant_type, gene, pd.Series('', index=df.index))
+        codes = np.where((found >= 0) & (codes == tier_ranks[Tier.TIER_NA]) & ~keep,
+                         found, codes)
+        for change in changes(df):
+            # 값이 없으면 유전자 단위 키와 같아지므로 variant 단위로 찾지 않음
+            has_change = (change.notna() & (change.astype(object) != '')).to_numpy()
+            found = self.lookup(variant_type, gene, change)
+            codes = np.where((found >= 0) & has_change & ~keep, found, codes)
+        return pd.Categorical.from_codes(codes, dtype=tiers.dtype)
+
+
+def load(index_file: Path):
+    return AnnotationIndex(index_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='annotation_index.py',
+                                     description='compile an annotation TSV into the'
+                                     ' memory-mapped index used for tiering')
+    parser.add_argument('source', type=Path, help='TSV with type, gene, change, tier columns')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+                        help=f'index file or folder to write {INDEX_FILE_NAME} in'
+                        ' (default: next to the TSV, place it next to blacklist.xlsx)')
+    args = parser.parse_args()
+    if not args.source.is_file():
+        sys.exit(f'No annotation file: {args.source}')
+    index_file = args.output or args.source.with_name(INDEX_FILE_NAME)
+    if index_file.is_dir() or index_file.suffix != '.json':
+        index_file = index_file / INDEX_FILE_NAME
+    try:
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        compile_index(args.source, index_file)
+    except OSError as e:
+        sys.exit(f'Could not write annotation index {index_file}: {e}')
+
+
+class AnnotationIndexTests(unittest.TestCase):
+    def test_missing_change_is_not_gene_key(self):
+        import tier_rules # pylint: disable=import-outside-toplevel
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_file = Path(temp_dir) / 'annotation.tsv'
+            source_file.write_text('type\tgene\tchange\ttier\nSNV\tTP53\t\tI/II\n',
+                                   encoding='utf-8')
+            compile_index(source_file, Path(temp_dir) / INDEX_FILE_NAME)
+            index = load(Path(temp_dir) / INDEX_FILE_NAME)
+            df = pd.DataFrame({Col.GENE_NAME: ['TP53', 'TP53'],
+                               Col.AA_CHANGE: [None, None],
+                               Col.NUCLEOTIDE_CHANGE: [None, 'c.1A>G'],
+                               Col.TOTAL_DEPTH: [1000, 1000],
+                               Col.CLINICAL_SIGNIFICANCE: ['Uncertain_significance', None],
+                               Col.HOTSPOT: [None, None]})
+            tiers, final = tier_rules.CompiledRules(
+                tier_rules.builtin_rules['SNV']).apply_with_final(df)
+            tiers = index.apply('SNV', df, tiers, final)
+        # 규칙으로 정한 III/IV는 유지, 규칙에 없는 행만 유전자 단위 tier로 채움
+        self.assertEqual(list(tiers), [Tier.TIER_3_4, Tier.TIER_1_2])
+
+
+if __name__ == '__main__':
+    main()
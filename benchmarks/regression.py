@@ -0,0 +1,237 @@
+# 검증된 케이스 묶음(golden corpus)으로 배포 전 보고서/중간 테이블 회귀 확인
+# python benchmarks/regression.py <corpus> [-j N] [--compare 이전결과.json] [--update-expected]
+# corpus 구성:
+#   <corpus>/cases/*.zip                     케이스 D(+R) zip
+#   <corpus>/expected/<케이스>/              이전 버전의 <케이스>_report.txt, _filtered_data.xlsx
+#   <corpus>/blacklist.xlsx 등               기관 설정 파일 (있으면 실행 폴더에 복사)
+# 결과는 benchmarks/results/regression_<시각>_<코드 버전>.json 에 저장
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import warnings
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# pylint: disable=wrong-import-position
+import core
+import stage_cache
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+SITE_FILES = ['blacklist.xlsx', 'tier_rules.json', 'annotation_index.json',
+              'annotation_index.keys.npy', 'annotation_index.tiers.npy']
+# 시트별 행 식별 칼럼 (같은 키가 여러 행이면 순서 번호를 더함)
+SHEET_KEYS = {
+    'SNV': ['Gene_name', 'AA_Change', 'Nucleotide_change'],
+    'CNV': ['Gene_name', 'Call', 'ID'],
+    'Fusion': ['ID', 'Gene'],
+}
+FLOAT_TOLERANCE = 1e-6
+MAX_LISTED = 20 # 케이스별로 기록하는 차이 수
+
+
+def _run(source_file: Path, output_dir: Path, options: core.RunOptions):
+    warnings.simplefilter('ignore', FutureWarning)
+    case_name = core._parse_case_name(source_file.stem)
+    start = time.perf_counter()
+    error = None
+    try:
+        core.run(source_file, output_dir / case_name, case_name, options)
+    except Exception: # pylint: disable=broad-exception-caught
+        import traceback # pylint: disable=import-outside-toplevel
+        error = traceback.format_exc()
+    return case_name, time.perf_counter() - start, error
+
+
+_number = re.compile(r'-?\d+\.\d+')
+
+
+# 공백 폭, 표 구분선, 소수 자릿수, 쉼표로 나열한 유전자 순서 차이는 무시
+def _normalize_line(line: str):
+    line = _number.sub(lambda x: f'{float(x.group()):.6g}', line)
+    cells = [x for x in re.split(r'\s{2,}', line.strip()) if x]
+    if not cells or all(set(x) <= set('-=') for x in cells):
+        return None
+    if len(cells) == 1 and ', ' in cells[0]: # 문장 안의 유전자 목록은 단어 집합으로 비교
+        return ' '.join(sorted(x for x in re.split(r'[\s,]+', cells[0]) if x))
+    return ' | '.join(cells)
+
+
+def diff_reports(expected_file: Path, actual_file: Path):
+    def lines(file):
+        return Counter(x for x in map(_normalize_line,
+                                      file.read_text(encoding='utf-8').splitlines())
+                       if x is not None)
+    expected, actual = lines(expected_file), lines(actual_file)
+    return {'missing': sorted((expected - actual).elements())[:MAX_LISTED],
+            'added': sorted((actual - expected).elements())[:MAX_LISTED]}
+
+
+def _read_sheets(file: Path):
+    import pandas as pd # pylint: disable=import-outside-toplevel
+    if file.suffix == '.xlsx':
+        return pd.read_excel(file, sheet_name=None, keep_default_na=False, na_values=[''])
+    return {x.stem: pd.read_csv(x, keep_default_na=False, na_values=[''])
+            for x in sorted(file.glob('*.csv'))}
+
+
+def _keyed(df, sheet: str):
+    key_columns = [x for x in SHEET_KEYS.get(sheet.replace('_nocall', ''), []) if x in df.columns]
+    df = df.fillna('')
+    keys = df[key_columns].astype(str).agg('/'.join, axis=1) if key_columns else \
+        df.index.astype(str).to_series(index=df.index)
+    keys = keys + '#' + keys.groupby(keys).cumcount().astype(str)
+    return df.set_index(keys)
+
+
+def _same(a, b):
+    try:
+        return abs(float(a) - float(b)) <= FLOAT_TOLERANCE
+    except (TypeError, ValueError):
+        return str(a) == str(b)
+
+
+def diff_tables(expected_file: Path, actual_file: Path):
+    expected, actual = _read_sheets(expected_file), _read_sheets(actual_file)
+    result = {}
+    for sheet in sorted(set(expected) | set(actual)):
+        if sheet not in expected or sheet not in actual:
+            result[sheet] = {'sheet': 'missing' if sheet not in actual else 'added'}
+            continue
+        old, new = _keyed(expected[sheet], sheet), _keyed(actual[sheet], sheet)
+        columns = [x for x in old.columns if x in new.columns]
+        changed = []
+        for key in old.index.intersection(new.index):
+            for column in columns:
+                if not _same(old.at[key, column], new.at[key, column]):
+                    changed.append(f'{key} {column}: {old.at[key, column]}'
+                                   f' -> {new.at[key, column]}')
+        sheet_diff = {
+            'missing_rows': sorted(old.index.difference(new.index))[:MAX_LISTED],
+            'added_rows': sorted(new.index.difference(old.index))[:MAX_LISTED],
+            'missing_columns': [x for x in old.columns if x not in new.columns],
+            'added_columns': [x for x in new.columns if x not in old.columns],
+            'changed': changed[:MAX_LISTED],
+        }
+        sheet_diff = {k: v for k, v in sheet_diff.items() if v}
+        if sheet_diff:
+            result[sheet] = sheet_diff
+    return result
+
+
+def check_case(case_name: str, expected_dir: Path, output_dir: Path):
+    diffs = {}
+    for name, differ in ((f'{case_name}_report.txt', diff_reports),
+                         (f'{case_name}_filtered_data.xlsx', diff_tables)):
+        expected_file, actual_file = expected_dir / name, output_dir / name
+        if not expected_file.exists():
+            diffs[name] = 'no expected output'
+        elif not actual_file.exists():
+            diffs[name] = 'not generated'
+        else:
+            diff = differ(expected_file, actual_file)
+            if any(diff.values()):
+                diffs[name] = diff
+    return diffs
+
+
+def compare(current: dict, previous: dict):
+    print(f'Runtime compared with {previous["code_version"]} ({previous["time"]}):')
+    for case_name, case in sorted(current['cases'].items()):
+        old = previous['cases'].get(case_name)
+        if old is None or not old['seconds']:
+            continue
+        ratio = case['seconds'] / old['seconds']
+        flag = '  <-- slower' if ratio > 1.2 else ''
+        print(f'  {case_name:<16} {old["seconds"]:8.2f}s -> {case["seconds"]:8.2f}s'
+              f'  x{ratio:5.2f}{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', type=Path)
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--compare', type=Path, default=None,
+                        help='previous regression result file to compare runtimes with')
+    parser.add_argument('--update-expected', action='store_true',
+                        help='replace the expected outputs with the outputs of this version')
+    parser.add_argument('--output', type=Path, default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    corpus = args.corpus.absolute()
+    source_files = core.find_case_files([corpus / 'cases'])
+    if not source_files:
+        sys.exit(f'No case zip file in {corpus / "cases"}')
+    os.chdir(ROOT) # resources/ 상대 경로
+    # 캐시를 사용하지 않아야 실제 계산 결과와 시간을 비교할 수 있음
+    options = core.RunOptions(stage_cache=False)
+    result = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'code_version': stage_cache.code_version(),
+        'corpus': str(corpus),
+        'cases': {}
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_dir = Path(temp_dir)
+        for name in SITE_FILES:
+            if (corpus / name).exists():
+                shutil.copy2(corpus / name, output_dir / name)
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(_run, x, output_dir, options) for x in source_files]
+            for future in as_completed(futures):
+                case_name, seconds, error = future.result()
+                case = {'seconds': round(seconds, 3)}
+                if error is not None:
+                    case.update(status='error', error=error)
+                else:
+                    case['diffs'] = check_case(case_name, corpus / 'expected' / case_name,
+                                               output_dir / case_name)
+                    case['status'] = 'diff' if case['diffs'] else 'ok'
+                result['cases'][case_name] = case
+                print(f'  {case_name:<16} {case["status"]:<6} {seconds:8.2f}s')
+        result['wall_seconds'] = round(time.perf_counter() - start, 3)
+
+        if args.update_expected:
+            for case_name, case in result['cases'].items():
+                if case['status'] == 'error':
+                    continue
+                expected_dir = corpus / 'expected' / case_name
+                expected_dir.mkdir(parents=True, exist_ok=True)
+                for name in (f'{case_name}_report.txt', f'{case_name}_filtered_data.xlsx'):
+                    shutil.copy2(output_dir / case_name / name, expected_dir / name)
+            print(f'Updated expected outputs in {corpus / "expected"}')
+
+    counts = Counter(x['status'] for x in result['cases'].values())
+    result['summary'] = dict(counts)
+    args.output.mkdir(parents=True, exist_ok=True)
+    result_file = args.output / \
+        f'regression_{datetime.now():%Y%m%d-%H%M%S}_{result["code_version"]}.json'
+    with open(result_file, 'wt', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f'{len(result["cases"])} cases in {result["wall_seconds"]:.1f}s:'
+          f' {counts["ok"]} ok, {counts["diff"]} with differences, {counts["error"]} failed')
+    for case_name, case in sorted(result['cases'].items()):
+        if case['status'] != 'ok':
+            print(f' - {case_name}: {case["status"]}')
+    print(f'Saved regression result: {result_file}')
+
+    if args.compare is not None:
+        with open(args.compare, 'rt', encoding='utf-8') as f:
+            compare(result, json.load(f))
+    if counts['diff'] or counts['error']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+# 단계별 실행 시간/메모리 측정
+# python benchmarks/run_benchmarks.py [--rows 2000 100000 1000000] [--compare 이전결과.json]
+# 결과는 benchmarks/results/<시각>_<코드 버전>.json 에 저장
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# pylint: disable=wrong-import-position
+import core
+import file_processor
+import stage_cache
+import table_processor
+import value_reader
+import variants
+import synthetic_case
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+SAMPLE_INTERVAL = 0.005
+
+
+def _rss():
+    try:
+        with open('/proc/self/statm', 'rt', encoding='ascii') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def _arrow_bytes():
+    if table_processor.pa is None:
+        return None
+    return table_processor.pa.default_memory_pool().bytes_allocated()
+
+
+# tracemalloc은 Arrow memory pool과 numpy 외의 C 할당을 보지 못하므로
+# 실행 중 RSS와 Arrow pool 사용량을 주기적으로 읽어 최댓값(시작 시점 대비 증가분)을 기록
+class _MemorySampler:
+    def __init__(self):
+        self.base = (_rss(), _arrow_bytes())
+        self.peak = self.base
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        self.peak = tuple(None if x is None else max(x, y)
+                          for x, y in zip(self.peak, (_rss(), _arrow_bytes())))
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self._sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def increase(self):
+        return tuple(None if x is None else x - y for x, y in zip(self.peak, self.base))
+
+
+def _measure(func, repeat: int, memory: bool):
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    stats = {'seconds': min(timings), 'peak_bytes': None}
+    if memory:
+        gc.collect()
+        with _MemorySampler() as sampler:
+            tracemalloc.start()
+            func()
+            stats['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        stats['rss_peak_bytes'], stats['arrow_peak_bytes'] = sampler.increase()
+    return result, stats
+
+
+# RowMasks는 처음 사용할 때 계산하므로 모든 Variant 클래스의 조건을 미리 계산해 측정
+def _partition_rows(df):
+    masks = table_processor.partition_rows(df)
+    for cls in (variants.SNV, variants.CNV, variants.Fusion):
+        cls.call_mask(masks)
+        cls.nocall_mask(masks)
+    return masks
+
+
+def benchmark_case(work_dir: Path, rows: int, repeat: int = 3, memory: bool = True):
+    print(f'Generating synthetic case with {rows} rows...')
+    D_file, R_file = synthetic_case.write_case(work_dir / 'input', rows=rows,
+                                               fusions=max(50, rows // 100))
+    dest_dir = work_dir / 'out' / 'M00-0001'
+
+    stages = {}
+
+    def stage(name, func, repeat=repeat, memory=memory):
+        result, stats = _measure(func, repeat, memory)
+        stages[name] = stats
+        memory_columns = [(' peak', 'peak_bytes'), (' rss', 'rss_peak_bytes'),
+                          (' arrow', 'arrow_peak_bytes')]
+        print(f'  {name:<34} {stats["seconds"] * 1000:10.1f} ms'
+              + ''.join(f' {label} {stats[key] / (1 << 20):8.1f} MB'
+                        for label, key in memory_columns if stats.get(key) is not None))
+        return result
+
+    # 이미 풀린 파일은 건너뛰므로 한 번만 측정
+    stage('unzip', lambda: [file_processor.unzip_to_destination_and_normalize(
+        x, dest_dir, selective=True) for x in (D_file, R_file)], repeat=1, memory=False)
+    files = file_processor.find_target_files(dest_dir)
+    metrics = (stage('read_coverage_metrics',
+                     lambda: value_reader.read_coverage_metrics(files['QC_FILE'])),
+               stage('parse_headers', lambda: value_reader.parse_headers(files['VCF_FILE'])),
+               stage('parse_tumor_fraction',
+                     lambda: value_reader.parse_tumor_fraction(files['TUMOR_FRACTION_FILE'])))
+    D_df = stage('parse_oncomine_file[D]',
+                 lambda: table_processor.parse_oncomine_file(files['ONCOMINE_D_FILE']))
+    R_df = stage('parse_oncomine_file[R]',
+                 lambda: table_processor.parse_oncomine_file(files['ONCOMINE_R_FILE']))
+
+    variants.initialize_variant_blacklist(None)
+    variants.initialize_site_tier_rules(None)
+    masks = stage('partition_rows', lambda: _partition_rows(D_df))
+    R_masks = _partition_rows(R_df)
+    snv = stage('SNV', lambda: variants.SNV(D_df, masks))
+    cnv = stage('CNV', lambda: variants.CNV(D_df, masks))
+    fusion = stage('Fusion', lambda: variants.Fusion(R_df, R_masks))
+
+    for table_format in ('xlsx', 'csv'):
+        stage(f'write_dataframe_as_sheet[{table_format}]',
+              lambda: table_processor.write_dataframe_as_sheet(
+                  dest_dir / 'M00-0001_filtered_data.xlsx', snv, cnv, fusion, table_format))
+    stage('generate_printable_gene_info',
+          lambda: table_processor.generate_printable_gene_info(snv, cnv, fusion))
+
+    text_form = (ROOT / 'resources' / 'report_text_format.txt').read_text(encoding='utf-8')
+    stage('render_report', lambda: core._render_report(text_form, metrics, (snv, cnv, fusion)))
+
+    return {'rows': rows, 'rows_per_sheet': {'SNV': len(snv.call), 'CNV': len(cnv.call),
+                                             'Fusion': len(fusion.call)},
+            'stages': stages}
+
+
+def compare(current: dict, previous: dict):
+    print(f'Compared with {previous["code_version"]} ({previous["time"]}):')
+    previous_cases = {x['rows']: x for x in previous['cases']}
+    for case in current['cases']:
+        old_case = previous_cases.get(case['rows'])
+        if old_case is None:
+            continue
+        for name, stats in case['stages'].items():
+            old = old_case['stages'].get(name)
+            if old is None or not old['seconds']:
+                continue
+            ratio = stats['seconds'] / old['seconds']
+            flag = '  <-- slower' if ratio > 1.2 else ''
+            print(f'  {case["rows"]:>8} {name:<34} x{ratio:5.2f}{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[2000, 100000],
+                        help='oncomine rows of each synthetic case (e.g. 2000 100000 1000000)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the memory (tracemalloc, RSS, Arrow pool) run of each stage')
+    parser.add_argument('--compare', type=Path, default=None,
+                        help='previous result file to compare with')
+    parser.add_argument('--output', type=Path, default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    os.chdir(ROOT) # resources/ 상대 경로
+    warnings.simplefilter('ignore', FutureWarning)
+    result = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'code_version': stage_cache.code_version(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cases': []
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for rows in args.rows:
+            work_dir = Path(temp_dir) / str(rows)
+            result['cases'].append(benchmark_case(work_dir, rows, args.repeat,
+                                                  not args.no_memory))
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    result_file = args.output / \
+        f'{datetime.now():%Y%m%d-%H%M%S}_{result["code_version"]}.json'
+    with open(result_file, 'wt', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f'Saved benchmark result: {result_file}')
+
+    if args.compare is not None:
+        with open(args.compare, 'rt', encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# 벤치마크용 가상 케이스 생성 (Ion Reporter export와 같은 zip 구조)
+# python benchmarks/synthetic_case.py <출력 폴더> [행 수] [케이스 이름]
+import sys
+import json
+import random
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from table_processor import oncomine_column_names # pylint: disable=wrong-import-position
+
+genes = ['EGFR', 'KRAS', 'TP53', 'BRAF', 'PIK3CA', 'ERBB2', 'MET', 'ALK', 'ROS1', 'RET',
+         'NRAS', 'IDH1', 'IDH2', 'BRCA1', 'BRCA2', 'UGT1A1', 'MAML3', 'MAMLD1', 'FOXA1']
+fusion_pairs = [('EML4', 'ALK'), ('CD74', 'ROS1'), ('KIF5B', 'RET'), ('TMPRSS2', 'ERG'),
+                ('FGFR3', 'TACC3'), ('NCOA4', 'RET'), ('SLC34A2', 'ROS1')]
+columns = ['vcf.rownum'] + [x for x in oncomine_column_names if x != 'Tier']
+
+
+def _row(rownum, values):
+    values['vcf.rownum'] = rownum
+    return '\t'.join(str(values.get(x, '.')) for x in columns)
+
+
+def _snv_row(r: random.Random, i):
+    gene = r.choice(genes)
+    ref, alt = r.sample('ACGT', 2)
+    return {
+        'FUNC1.gene': gene, 'FUNC1.protein': f'p.Ala{i}Val', 'FUNC1.coding': f'c.{i}{ref}>{alt}',
+        'INFO.A.AF': round(r.random(), 4), 'INFO.1.FDP': r.randint(100, 3000),
+        'INFO.A.FAO': r.randint(0, 500), 'FUNC1.transcript': f'NM_{r.randint(1, 999999):06d}.1',
+        'FUNC1.function': r.choice(['missense', 'missense', 'nonsense', 'synonymous', '.']),
+        'FUNC1.oncomineGeneClass': r.choice(['Gain-of-Function', 'Loss-of-Function', '.']),
+        'FUNC1.oncomineVariantClass': r.choice(['Hotspot', 'Deleterious', '.', '.']),
+        'FUNC1.location': r.choice(['exonic', 'exonic', 'intronic', 'utr_3', 'utr_5']),
+        'rowtype': r.choice(['snp', 'snp', 'del', 'ins', 'mnp', 'complex']),
+        'FUNC1.CLNSIG1': r.choice(['Pathogenic', 'Benign', 'Uncertain_significance', '.', '.']),
+        'CHROM': f'chr{r.randint(1, 22)}', 'POS': r.randint(10000, 200000000),
+        'call': r.choice(['POS', 'NEG', 'NEG', 'NEG', 'NOCALL']),
+        'QUAL': round(r.uniform(10, 5000), 1), 'FILTER': r.choice(['PASS', 'NOCALL']),
+    }
+
+
+def _cnv_row(r: random.Random, i):
+    gene = r.choice(genes)
+    return {
+        'FUNC1.gene': gene, 'INFO.1.GENE_NAME': gene, 'rowtype': 'CNV',
+        'FORMAT.1.CN': round(r.uniform(0, 12), 2), 'call': r.choice(['AMP', 'DEL', 'NEG', 'NOCALL']),
+        'CHROM': f'chr{r.randint(1, 22)}', 'POS': r.randint(10000, 200000000), 'ID': f'CNV_{i}',
+        'INFO...CI': '0.05:1.5,0.95:2.5', 'INFO...LEN': r.randint(1000, 500000),
+        'INFO...CDF_MAPD': round(r.uniform(0.1, 0.6), 3), 'FILTER': 'PASS',
+    }
+
+
+def oncomine_rows(n: int, seed: int = 0):
+    r = random.Random(seed)
+    for i in range(n):
+        kind = r.random()
+        if kind < 0.7:
+            yield _row(i, _snv_row(r, i))
+        elif kind < 0.8:
+            yield _row(i, _cnv_row(r, i))
+        else:
+            yield _row(i, {'rowtype': r.choice(['LOH', 'hotspot', 'RNAExonTiles']), 'call': 'NEG',
+                           'CHROM': f'chr{r.randint(1, 22)}', 'POS': r.randint(10000, 200000000)})
+
+
+def fusion_rows(n: int, seed: int = 0):
+    r = random.Random(seed)
+    rownum = 0
+    for i in range(n):
+        gene_a, gene_b = r.choice(fusion_pairs)
+        call = r.choice(['POS', 'NEG', 'NEG'])
+        read_count = r.randint(0, 5000)
+        for suffix, gene in enumerate((gene_a, gene_b), 1):
+            yield _row(rownum, {
+                'INFO.1.GENE_NAME': gene, 'rowtype': 'Fusion', 'call': call,
+                'ID': f'{gene_a}-{gene_b}.F{i}_{suffix}', 'CHROM': f'chr{r.randint(1, 22)}',
+                'POS': r.randint(10000, 200000000), 'INFO...READ_COUNT': read_count,
+                'INFO.1.EXON_NUM': r.randint(1, 30), 'INFO.1.ANNOTATION': 'synthetic',
+                'ALT': 'N[chr1:100[', 'FILTER': 'PASS' if call == 'POS' else 'FAIL'})
+            rownum += 1
+
+
+def oncomine_text(rows):
+    return '##fileformat=VCFv4.1\n##source=synthetic\n' + '\t'.join(columns) + '\n' \
+        + ''.join(x + '\n' for x in rows)
+
+
+def vcf_text(records: int = 1000):
+    return ('##fileformat=VCFv4.1\n##MSIScore=12.3456\n##MSIStatus=MSS\n##percentLOH=13.5\n'
+            '##TMBMutationsPerMb=5.6\n##manually_input_percent_tumor_cellularity=60\n'
+            '##mapd=0.3\n##INFO=<ID=AF,Number=A,Type=Float>\n#CHROM\tPOS\tID\tREF\tALT\n'
+            + 'chr1\t1\t.\tA\tG\n' * records)
+
+
+def tumor_fraction_json():
+    return json.dumps({'genomic_instability_metric': 12.5,
+                       'genomic_instability_status': 'Negative'})
+
+
+def qc_pdf(case_name: str, pages: int = 10):
+    import fitz # pylint: disable=import-outside-toplevel
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        if i == pages // 2:
+            page.insert_text((72, 72), 'Coverage metrics\nSample Name\nBarCode\nMapped Reads\n'
+                             'On Target\nMean Depth\nUniformity\n'
+                             f'{case_name}D\nIonXpress_001\n12345678\n95.50%\n1500.3\n93.20%\n')
+        else:
+            page.insert_text((72, 72), f'Run summary page {i}\n' + 'lorem ipsum\n' * 40)
+    return doc.tobytes()
+
+
+# D zip과 R zip을 만들어 경로를 반환
+def write_case(out_dir: Path, case_name: str = 'M00-0001', rows: int = 2000,
+               fusions: int = 50, seed: int = 0):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = '2024-01-01_00-00-00'
+    D_dir = f'Variants/{case_name}D_v1'
+    D_file = out_dir / f'{case_name}D_v1_{case_name}R_v1_c0001_{stamp}.zip'
+    with zipfile.ZipFile(D_file, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(f'{D_dir}/{case_name}D_v1_{stamp}-oncomine.tsv',
+                   oncomine_text(oncomine_rows(rows, seed)))
+        z.writestr(f'{D_dir}/{case_name}D_v1_{stamp}.vcf', vcf_text())
+        z.writestr(f'QC/{case_name}D_v1_QC.pdf', qc_pdf(case_name))
+        z.writestr('CnvActor/TumorFraction/tumor_fraction.json', tumor_fraction_json())
+    R_file = out_dir / f'{case_name}R_v1_c0001_{stamp}.zip'
+    with zipfile.ZipFile(R_file, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(f'Variants/{case_name}R_v1/{case_name}R_v1_{stamp}-oncomine.tsv',
+                   oncomine_text(fusion_rows(fusions, seed)))
+    return D_file, R_file
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    kwargs = {}
+    if len(args) > 1:
+        kwargs['rows'] = int(args[1])
+    if len(args) > 2:
+        kwargs['case_name'] = args[2]
+    files = write_case(Path(args[0]), **kwargs)
+    print('\n'.join(str(x) for x in files))
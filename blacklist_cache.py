@@ -0,0 +1,57 @@
+import hashlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import file_processor
+from constants import Col
+
+key_columns = [Col.GENE_NAME, Col.AA_CHANGE, Col.NUCLEOTIDE_CHANGE]
+
+
+class Blacklist:
+    def __init__(self, keys):
+        self.keys = frozenset(tuple(x) for x in keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # blacklist에 포함된 행 여부 (빈 값은 빈 값끼리 일치)
+    def matches(self, df: pd.DataFrame) -> np.ndarray:
+        if not self.keys or df.empty:
+            return np.zeros(len(df), dtype=bool)
+        index = pd.MultiIndex.from_arrays(
+            [df[x].astype(object).where(df[x].notna(), '') for x in key_columns])
+        return index.isin(list(self.keys))
+
+
+def _compile(file: Path):
+    df = pd.read_excel(file, header=None)
+    df.columns = key_columns
+    # df.loc[len(df)] = ['MAMLD1', 'p.Ala565Ser', 'c.1693G>T']
+    return df.fillna('').astype(str).values.tolist()
+
+
+def _cache_file(file: Path):
+    return file.with_name(f'.{file.name}.cache.json')
+
+
+# xlsx 변경 시(mtime/size가 다르고 내용 hash도 다를 때)에만 다시 읽음
+# 프로세스 안에서 다시 읽지 않는 것은 core._load_file이 담당
+def load(file: Path) -> Blacklist:
+    stat = file.stat()
+    stamp = [stat.st_mtime_ns, stat.st_size]
+    cache_file = _cache_file(file)
+    cache = file_processor.read_json(cache_file)
+    if cache is not None and cache.get('stamp') == stamp:
+        keys = cache['keys']
+    else:
+        digest = hashlib.sha256(file.read_bytes()).hexdigest()
+        if cache is not None and cache.get('sha256') == digest:
+            keys = cache['keys']
+        else:
+            keys = _compile(file)
+            print(f'Compiled blacklist cache: {cache_file} ({len(keys)} entries)')
+        file_processor.write_json_atomic(cache_file, {'stamp': stamp, 'sha256': digest,
+                                                      'keys': keys})
+
+    return Blacklist(keys)
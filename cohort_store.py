@@ -0,0 +1,184 @@
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+from constants import Col, Tier
+from variants import Variant
+
+# 케이스별 SNV/CNV/Fusion call, nocall 행을 모아 두는 SQLite 저장소
+schema = '''
+CREATE TABLE IF NOT EXISTS cases (
+    case_name TEXT PRIMARY KEY,
+    source TEXT,
+    added TEXT
+);
+CREATE TABLE IF NOT EXISTS variants (
+    case_name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    called INTEGER NOT NULL,
+    gene TEXT,
+    aa_change TEXT,
+    nucleotide_change TEXT,
+    tier TEXT,
+    vaf REAL,
+    copy_number REAL,
+    total_read REAL,
+    variant_id TEXT,
+    chromosome TEXT,
+    position INTEGER
+);
+CREATE INDEX IF NOT EXISTS variants_change ON variants (gene, aa_change, nucleotide_change);
+CREATE INDEX IF NOT EXISTS variants_tier ON variants (tier);
+CREATE INDEX IF NOT EXISTS variants_case ON variants (case_name);
+'''
+
+# 저장소 칼럼: 테이블 칼럼 (Fusion은 GENE_NAME 대신 GENE)
+store_columns = {
+    'gene': Col.GENE_NAME,
+    'aa_change': Col.AA_CHANGE,
+    'nucleotide_change': Col.NUCLEOTIDE_CHANGE,
+    'tier': Col.TIER,
+    'vaf': Col.VAF,
+    'copy_number': Col.COPY_NUMBER,
+    'total_read': Col.TOTAL_READ,
+    'variant_id': Col.ID,
+    'chromosome': Col.CHROMOSOME,
+    'position': Col.POSITION,
+}
+
+
+def _to_rows(case_name: str, kind: str, called: bool, df: pd.DataFrame):
+    rows = pd.DataFrame({'case_name': case_name, 'kind': kind, 'called': int(called)},
+                        index=range(len(df)))
+    for name, column in store_columns.items():
+        if kind == 'Fusion' and name == 'gene':
+            column = Col.GENE
+        if column in df.columns:
+            values = df[column]
+            if name == 'tier':
+                # categorical이면 category 값만 문자열로 변환
+                values = values.map(str, na_action='ignore')
+            values = values.astype(object)
+            rows[name] = values.where(values.notna(), None).to_numpy()
+        else:
+            rows[name] = None
+    return rows
+
+
+class CohortStore:
+    def __init__(self, db_file: Path):
+        self.db_file = db_file
+        # 배치 모드에서 여러 프로세스가 동시에 기록하므로 WAL과 대기 시간 사용
+        self.connection = sqlite3.connect(str(db_file), timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # 같은 케이스를 다시 실행하면 이전 행을 교체
+    def add_case(self, case_name: str, variants: list[Variant], source: str = None):
+        rows = pd.concat([_to_rows(case_name, x.__class__.__qualname__, called, df)
+                          for x in variants
+                          for called, df in ((True, x.call), (False, x.nocall))],
+                         ignore_index=True)
+        with self.connection:
+            self.connection.execute('DELETE FROM variants WHERE case_name = ?', (case_name,))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO cases VALUES (?, ?, ?)',
+                (case_name, source, datetime.now().isoformat(timespec='seconds')))
+            rows.to_sql('variants', self.connection, if_exists='append', index=False)
+        return len(rows)
+
+    def case_count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM cases').fetchone()[0]
+
+    def query(self, gene: str = None, aa_change: str = None, nucleotide_change: str = None,
+              tier: str = None, kind: str = None, called: bool = None):
+        conditions = {'gene': gene, 'aa_change': aa_change,
+                      'nucleotide_change': nucleotide_change, 'tier': tier, 'kind': kind,
+                      'called': None if called is None else int(called)}
+        conditions = {k: v for k, v in conditions.items() if v is not None}
+        where = ' AND '.join(f'{k} = ?' for k in conditions) or '1'
+        return pd.read_sql_query(f'SELECT * FROM variants WHERE {where}', self.connection,
+                                 params=list(conditions.values()))
+
+    # 변이가 발견된 케이스 수와 전체 케이스 대비 비율
+    def recurrence(self, gene: str, aa_change: str = None, nucleotide_change: str = None,
+                   called: bool = True):
+        df = self.query(gene, aa_change, nucleotide_change, called=called)
+        total = self.case_count()
+        summary = df.groupby(['kind', 'gene', 'aa_change', 'nucleotide_change'], dropna=False)\
+            .agg(cases=('case_name', 'nunique'), mean_vaf=('vaf', 'mean'),
+                 min_vaf=('vaf', 'min'), max_vaf=('vaf', 'max'))\
+            .reset_index()
+        summary['fraction'] = summary['cases'] / total if total else 0.0
+        return summary.sort_values('cases', ascending=False, ignore_index=True)
+
+    # 여러 케이스에서 반복적으로 낮은 VAF로 나오는 SNV call (blacklist 후보)
+    def blacklist_candidates(self, min_fraction: float = 0.2, min_cases: int = 5,
+                             max_mean_vaf: float = 0.3):
+        total = self.case_count()
+        excluded = [str(x) for x in (Tier.TIER_1, Tier.TIER_1_2, Tier.TIER_BLACKLIST)]
+        df = pd.read_sql_query(
+            f'''SELECT gene, aa_change, nucleotide_change,
+                   COUNT(DISTINCT case_name) AS cases, AVG(vaf) AS mean_vaf,
+                   MIN(vaf) AS min_vaf, MAX(vaf) AS max_vaf
+               FROM variants
+               WHERE kind = 'SNV' AND called = 1
+                   AND tier NOT IN ({', '.join('?' * len(excluded))})
+               GROUP BY gene, aa_change, nucleotide_change
+               HAVING cases >= ? AND cases >= ? * ? AND mean_vaf <= ?
+               ORDER BY cases DESC''',
+            self.connection, params=[*excluded, min_cases, min_fraction, total, max_mean_vaf])
+        df['fraction'] = df['cases'] / total if total else 0.0
+        return df
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='cohort_store.py',
+                                     description='query the cohort variant store')
+    parser.add_argument('db', type=Path)
+    commands = parser.add_subparsers(dest='command', required=True)
+    recurrence = commands.add_parser('recurrence', help='cases carrying a variant')
+    recurrence.add_argument('gene')
+    recurrence.add_argument('aa_change', nargs='?')
+    recurrence.add_argument('nucleotide_change', nargs='?')
+    recurrence.add_argument('--nocall', action='store_true',
+                            help='count nocall rows instead of calls')
+    candidates = commands.add_parser('blacklist-candidates',
+                                     help='recurrent low-VAF SNV calls')
+    candidates.add_argument('--min-fraction', type=float, default=0.2)
+    candidates.add_argument('--min-cases', type=int, default=5)
+    candidates.add_argument('--max-mean-vaf', type=float, default=0.3)
+    candidates.add_argument('--output', type=Path, default=None,
+                            help='save as xlsx in the blacklist.xlsx layout')
+    args = parser.parse_args()
+
+    if not args.db.exists():
+        sys.exit(f'No cohort store: {args.db}')
+    with CohortStore(args.db) as store:
+        print(f'Cases in store: {store.case_count()}')
+        if args.command == 'recurrence':
+            df = store.recurrence(args.gene, args.aa_change, args.nucleotide_change,
+                                  called=not args.nocall)
+        else:
+            df = store.blacklist_candidates(args.min_fraction, args.min_cases,
+                                            args.max_mean_vaf)
+            if args.output is not None:
+                df[['gene', 'aa_change', 'nucleotide_change']].to_excel(
+                    args.output, header=False, index=False)
+                print(f'Saved blacklist candidates: {args.output}')
+    print(df.to_string(index=False) if not df.empty else 'Not Found')
+
+
+if __name__ == '__main__':
+    main()
@@ -41,6 +41,8 @@ class Col(object):
 
 columns = [value for name, value in vars(Col).items() if not name.startswith('_')]
 
+table_formats = ['xlsx', 'csv', 'parquet'] # 중간 테이블 출력 형식
+
 
 class Metrics:
     MAPPED_READS = 'Mapped Reads'
@@ -67,12 +69,15 @@ class Tier(Enum):
 
     @property
     def index(self):
-        return list(Tier).index(self)
+        return tier_ranks[self]
 
     def __str__(self):
         return self.value
 
     def __lt__(self, other):
-        return self.index < other.index
+        return tier_ranks[self] < tier_ranks[other]
+
+# 비교할 때마다 멤버 목록을 만들지 않도록 미리 계산한 순위 (tier_rules.tier_dtype의 code와 같음)
+tier_ranks = {x: i for i, x in enumerate(Tier)}
 
 assert Tier.TIER_NA < Tier.TIER_3
@@ -1,15 +1,35 @@
+import time
+_START_TIME = time.perf_counter()
+
 import os
 import sys
+import glob
+import argparse
+import importlib
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 import pprint
-from pandas import DataFrame
-from tabulate import tabulate
-from numpy import nan
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
 
 import file_processor
-import value_reader
-import table_processor
-from constants import Metrics, Tier, Col
+import stage_cache
+import stage_trace
+import scheduler
+from constants import Metrics, Tier, Col, table_formats
+
+# pandas, fitz 등 무거운 모듈은 필요한 단계에서 import (인자 오류 등은 바로 종료)
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+_ENTRY_IMPORT_TIME = time.perf_counter() - _START_TIME
+ENTRY_IMPORT_BUDGET = 0.2 # 초
+HEAVY_MODULES = ['numpy', 'pandas', 'pyarrow.csv', 'tabulate', 'fitz', 'xlsxwriter',
+                 'value_reader', 'table_processor', 'tier_rules', 'workbook_writer']
 
 
 MAPD_POOR_NOTE = 'Note) Sample의 질이 좋지 않아 (MAPD > 0.5) LOH score를 계산할'\
@@ -18,44 +38,291 @@ MAPD_FAIR_NOTE = 'Note) Sample의 질이 좋지 않아 (MAPD ≒ 0.5) LOH score
     ' 수 없습니다.'
 UNIFORMITY_POOR_NOTE = 'Note) Sequencing의 질이 좋지 않아 신뢰도가 낮으므로'\
     ' (uniformity < 90%) 임상 적용시 주의가 필요합니다.'
-
-
-def run(source_file: Path, dest_dir, case_name):
-    file_processor.unzip_to_destination_and_normalize(source_file, dest_dir)
+CACHE_DIR_NAME = '.oncomine_cache'
+
+
+@dataclass
+class RunOptions:
+    extract_all: bool = False # BAM 등 보고서에 사용하지 않는 파일까지 모두 추출
+    extract_workers: int = 4
+    in_memory: bool = False # 압축을 풀지 않고 zip 내부 파일을 직접 읽음
+    cache_dir: Path = None # 기본값: 케이스 폴더 상위의 CACHE_DIR_NAME
+    table_format: str = 'xlsx' # 중간 테이블 형식: xlsx, csv, parquet
+    stage_cache: bool = True # 단계별 결과를 cache_dir/stages에 저장해 재사용
+    cache_max_mb: int = 1024
+    stage_workers: int = 4 # 서로 의존하지 않는 단계를 동시에 실행하는 스레드 수
+    memory_limit_mb: int = None # 지정하면 메모리 제한 모드 (chunk 단위 읽기, 작은 dtype)
+    cohort_db: Path = None # 케이스별 variant 테이블을 누적하는 SQLite 파일
+    profile: bool = False # 최상위 단계별 cProfile 결과를 <케이스>_profile 폴더에 저장
+    report_only: bool = False # 보고서만 생성 (nocall 테이블과 중간 테이블 파일 생략)
+
+
+def run(source_file: Path, dest_dir, case_name, options: RunOptions = None):
+    options = options or RunOptions()
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    profile_dir = dest_dir / f'{case_name}_profile' if options.profile else None
+    tracer = stage_trace.start(profile_dir)
+    previous_limit = None
+    try:
+        if options.memory_limit_mb is not None:
+            previous_limit = _apply_memory_limit(options.memory_limit_mb)
+        _run_stages(source_file, dest_dir, case_name, options)
+    finally:
+        # batch worker, 서버 등 같은 프로세스에서 이어지는 작업에는 제한을 적용하지 않음
+        _restore_memory_limit(previous_limit)
+        stage_trace.finish()
+        tracer.write(dest_dir / f'{case_name}_trace.json')
+    return tracer
+
+
+# 메모리 제한: chunk 크기를 제한의 약 1/16로 잡고(행당 약 2KB로 가정), 가능하면
+# RLIMIT_DATA를 설정해 VM 전체가 아닌 해당 케이스만 MemoryError로 실패하게 함
+# RLIMIT_DATA에는 이미 import한 모듈과 thread stack도 포함되므로 MIN_MEMORY_LIMIT_MB보다
+# 작으면 단계 thread를 시작하지 못함
+MIN_MEMORY_LIMIT_MB = 256
+
+
+def _oncomine_chunksize(memory_limit_mb: int):
+    if memory_limit_mb is None:
+        return None
+    return max(1000, (memory_limit_mb << 20) // 16 // 2048)
+
+
+def _apply_memory_limit(memory_limit_mb: int):
+    if memory_limit_mb < MIN_MEMORY_LIMIT_MB:
+        raise ValueError(f'Memory limit must be at least {MIN_MEMORY_LIMIT_MB} MB:'
+                         f' {memory_limit_mb}')
+    try:
+        import resource # pylint: disable=import-outside-toplevel
+    except ImportError: # windows
+        return None
+    limit = memory_limit_mb << 20
+    previous = resource.getrlimit(resource.RLIMIT_DATA)
+    hard = previous[1]
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+    return previous
+
+
+def _restore_memory_limit(previous):
+    if previous is None:
+        return
+    import resource # pylint: disable=import-outside-toplevel
+    resource.setrlimit(resource.RLIMIT_DATA, previous)
+
+
+def _run_stages(source_file: Path, dest_dir, case_name, options: RunOptions):
+    import value_reader # pylint: disable=import-outside-toplevel
+    import table_processor # pylint: disable=import-outside-toplevel
+
+    chunksize = _oncomine_chunksize(options.memory_limit_mb)
+    cache_dir = options.cache_dir or dest_dir.parent / CACHE_DIR_NAME
+    cache = stage_cache.StageCache(cache_dir, options.cache_max_mb << 20,
+                                   enabled=options.stage_cache)
+    worksheet = dest_dir / (case_name + '_filtered_data.xlsx')
+    if options.table_format != 'xlsx':
+        worksheet = worksheet.with_suffix('')
+
+    def inputs():
+        files_to_read = _prepare_inputs(source_file, dest_dir, case_name, options, cache)
+        files_to_read_paths = {k: str(v) for k, v in files_to_read.items()}
+        print(f'files to read: \n{pprint.pformat(files_to_read_paths)}')
+        assert all(files_to_read[x] is not None for x in
+                   ('ONCOMINE_D_FILE', 'VCF_FILE', 'QC_FILE', 'TUMOR_FRACTION_FILE'))
+        return files_to_read
+
+    def keys(files_to_read):
+        fingerprints = {k: stage_cache.fingerprint(v) for k, v in files_to_read.items()}
+        keys = {
+            'qc': stage_cache.stage_key(fingerprints['QC_FILE']),
+            'headers': stage_cache.stage_key(fingerprints['VCF_FILE']),
+            'tumor_fraction': stage_cache.stage_key(fingerprints['TUMOR_FRACTION_FILE']),
+            'oncomine_D': stage_cache.stage_key(chunksize is not None,
+                                                fingerprints['ONCOMINE_D_FILE']),
+            'oncomine_R': stage_cache.stage_key(chunksize is not None,
+                                                fingerprints['ONCOMINE_R_FILE']),
+        }
+        keys['variants'] = stage_cache.stage_key(
+            keys['oncomine_D'], keys['oncomine_R'],
+            fingerprints['BLACKLIST_FILE'], fingerprints['TIER_RULES_FILE'],
+            fingerprints['ANNOTATION_INDEX_FILE'])
+        return keys
+
+    def read_value(name, read, file_key):
+        return lambda files_to_read, keys: cache.get_or_compute(
+            name, keys[name], lambda: read(files_to_read[file_key]))
+
+    def read_oncomine(name, file_key):
+        def read(files_to_read, keys, cached_variants):
+            if cached_variants is not None or files_to_read[file_key] is None:
+                return None
+            return cache.get_or_compute(
+                'oncomine', keys[name],
+                lambda: table_processor.parse_oncomine_file(files_to_read[file_key],
+                                                            chunksize=chunksize))
+        return read
+
+    def tier(cached_variants, D_oncomine_df, R_oncomine_df, site_config, keys):
+        if cached_variants is not None:
+            variants = cached_variants
+        else:
+            variants = table_processor.generate_variants(D_oncomine_df, R_oncomine_df,
+                                                         *site_config)
+        stage_trace.annotate('rows', {x.__class__.__qualname__: len(x.call) for x in variants})
+        return variants
+
+    # 저장하려면 nocall 테이블을 만들어야 하므로 보고서와 중간 테이블을 쓴 뒤에 저장
+    # (report-only 모드에서는 nocall을 만들지 않도록 저장하지 않음, 보고서는 report 캐시 사용)
+    def cache_variants(cached_variants, variants, keys, *_):
+        if cached_variants is None:
+            cache.put('variants', keys['variants'], variants)
+
+    def cohort(variants):
+        import cohort_store # pylint: disable=import-outside-toplevel
+        with cohort_store.CohortStore(options.cohort_db) as store:
+            stage_trace.annotate('rows', store.add_case(case_name, variants, source_file.name))
+
+    # 같은 variants로 쓴 파일이 그대로 있을 때만 다시 쓰지 않음
+    # (blacklist를 되돌린 경우처럼 캐시된 variants가 다른 실행의 결과일 수 있음)
+    def workbook(variants, keys):
+        workbook_key = stage_cache.stage_key(str(worksheet))
+        written = cache.get('workbook', workbook_key)
+        if worksheet.exists() and written == (keys['variants'], worksheet.stat().st_mtime_ns):
+            print(f'Intermediate table is up to date: {worksheet}')
+            return
+        written = table_processor.write_dataframe_as_sheet(worksheet, *variants,
+                                                           options.table_format)
+        cache.put('workbook', workbook_key, (keys['variants'], worksheet.stat().st_mtime_ns))
+        print(f'Printed intermediate table to worksheet: {written}')
+
+    def report(coverage_metrics, headers, genomic_instability, variants, keys):
+        text_form = _load_file(Path('resources/report_text_format.txt'), _read_text)
+        metrics = coverage_metrics, headers, genomic_instability
+        report_key = stage_cache.stage_key(keys['qc'], keys['headers'], keys['tumor_fraction'],
+                                           keys['variants'], text_form)
+        full_text = cache.get_or_compute('report', report_key,
+                                         lambda: _render_report(text_form, metrics, variants))
+
+        report_file = dest_dir / f'{case_name}_report.txt'
+        with open(report_file, 'wt', encoding='utf-8') as f:
+            f.write(full_text)
+            # f.write(wrapped_text)
+        print(f'Generated report text file: {report_file}')
+
+    # cProfile은 동시에 하나만 켤 수 있으므로 profile 모드에서는 순차 실행
+    tasks = scheduler.Scheduler(1 if options.profile else options.stage_workers)
+    tasks.add('inputs', inputs)
+    tasks.add('keys', keys, 'inputs')
+    tasks.add('qc', read_value('qc', value_reader.read_coverage_metrics, 'QC_FILE'),
+              'inputs', 'keys')
+    tasks.add('headers', read_value('headers', value_reader.parse_headers, 'VCF_FILE'),
+              'inputs', 'keys')
+    tasks.add('tumor_fraction', read_value('tumor_fraction', value_reader.parse_tumor_fraction,
+                                           'TUMOR_FRACTION_FILE'), 'inputs', 'keys')
+    tasks.add('cached_variants', lambda keys: cache.get('variants', keys['variants']), 'keys')
+    tasks.add('oncomine_D', read_oncomine('oncomine_D', 'ONCOMINE_D_FILE'),
+              'inputs', 'keys', 'cached_variants')
+    tasks.add('oncomine_R', read_oncomine('oncomine_R', 'ONCOMINE_R_FILE'),
+              'inputs', 'keys', 'cached_variants')
+    tasks.add('site_config', _read_site_config, 'inputs', 'cached_variants')
+    tasks.add('variants', tier, 'cached_variants', 'oncomine_D', 'oncomine_R', 'site_config',
+              'keys')
+    if options.cohort_db is not None:
+        tasks.add('cohort', cohort, 'variants')
+    tasks.add('report', report, 'qc', 'headers', 'tumor_fraction', 'variants', 'keys')
+    if not options.report_only:
+        tasks.add('workbook', workbook, 'variants', 'keys')
+        tasks.add('cache_variants', cache_variants, 'cached_variants', 'variants', 'keys',
+                  'workbook', 'report')
+    tasks.run()
+    tasks.print_summary()
+    stage_trace.set_info('scheduler', tasks.summary())
+
+
+def _prepare_inputs(source_file: Path, dest_dir: Path, case_name, options: RunOptions,
+                    cache: stage_cache.StageCache):
     fusion_file = file_processor.find_fusion_file(source_file.parent, case_name)
+    if options.in_memory:
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        source_files = [x for x in (source_file, fusion_file) if x is not None]
+        return file_processor.find_target_members(source_files, dest_dir)
+
+    # 같은 내용의 zip을 이미 풀어 둔 경우 압축 해제와 파일 탐색을 건너뜀
+    key = stage_cache.stage_key(dest_dir, options.extract_all,
+                                stage_cache.zip_fingerprint(source_file),
+                                stage_cache.zip_fingerprint(fusion_file))
+    files_to_read = cache.get('inputs', key)
+    if files_to_read is not None and \
+            all(x is None or Path(x).exists() for x in files_to_read.values()):
+        # 설정 파일은 케이스 zip과 별개로 추가되거나 삭제될 수 있음
+        files_to_read.update(file_processor.find_site_files(dest_dir))
+        return files_to_read
+
+    unzip_kwargs = {'selective': not options.extract_all,
+                    'workers': options.extract_workers}
+    file_processor.unzip_to_destination_and_normalize(source_file, dest_dir,
+                                                      **unzip_kwargs)
     if fusion_file is not None:
-        file_processor.unzip_to_destination_and_normalize(fusion_file, dest_dir)
+        file_processor.unzip_to_destination_and_normalize(fusion_file, dest_dir,
+                                                          **unzip_kwargs)
     files_to_read = file_processor.find_target_files(dest_dir)
-    files_to_read_paths = {k: str(v) for k, v in files_to_read.items()}
-    print(f'files to read: \n{pprint.pformat(files_to_read_paths)}')
-
-    oncomine_D_file = files_to_read['ONCOMINE_D_FILE']
-    oncomine_R_file = files_to_read['ONCOMINE_R_FILE']
-    vcf_file = files_to_read['VCF_FILE']
-    qc_file = files_to_read['QC_FILE']
-    tumor_fraction_file = files_to_read['TUMOR_FRACTION_FILE']
-    blacklist_file = files_to_read['BLACKLIST_FILE']
-    assert oncomine_D_file is not None and vcf_file is not None and qc_file is not None and tumor_fraction_file is not None
-
-    qc_pdf_text = value_reader.read_pdf_as_text(qc_file)
-    coverage_metrics = value_reader.parse_coverage_metrics(qc_pdf_text)
-    assert coverage_metrics is not None
+    cache.put('inputs', key, files_to_read)
+    return files_to_read
 
-    headers = value_reader.parse_headers(vcf_file)
 
-    genomic_instability_metric, genomic_instability_status = value_reader.parse_tumor_fraction(tumor_fraction_file)
+# blacklist.xlsx, tier_rules.json, annotation_index.json (variant 캐시가 있으면 읽지 않음)
+def _read_site_config(files_to_read: dict, cached_variants):
+    import table_processor # pylint: disable=import-outside-toplevel
+    import tier_rules # pylint: disable=import-outside-toplevel
+    import annotation_index # pylint: disable=import-outside-toplevel
 
-    D_oncomine_df = table_processor.parse_oncomine_file(oncomine_D_file)
-    if oncomine_R_file is not None:
-        R_oncomine_df = table_processor.parse_oncomine_file(oncomine_R_file)
-    else:
-        R_oncomine_df = None
-    blacklist = None if blacklist_file is None else table_processor.read_blacklist(blacklist_file)
-    snv, cnv, fusion = table_processor.generate_variants(D_oncomine_df, R_oncomine_df, blacklist)
-    worksheet = dest_dir / (case_name + '_filtered_data.xlsx')
-    table_processor.write_dataframe_as_sheet(worksheet, snv, cnv, fusion)
-    print(f'Printed intermediate table to worksheet: {worksheet}')
-    
+    if cached_variants is not None:
+        return None
+    blacklist_file = files_to_read['BLACKLIST_FILE']
+    tier_rules_file = files_to_read['TIER_RULES_FILE']
+    annotation_file = files_to_read['ANNOTATION_INDEX_FILE']
+    blacklist = None if blacklist_file is None else \
+        _load_file(blacklist_file, table_processor.read_blacklist)
+    site_tier_rules = None if tier_rules_file is None else \
+        _load_file(tier_rules_file, tier_rules.load_site_rules)
+    annotation = None if annotation_file is None else \
+        _load_file(annotation_file, annotation_index.load)
+    return blacklist, site_tier_rules, annotation
+
+
+# 서버 모드나 batch worker처럼 한 프로세스가 여러 케이스를 처리할 때 보고서 양식, blacklist,
+# tier 규칙을 다시 읽지 않도록 (경로, 크기, 수정 시각)이 같으면 읽어 둔 값을 사용
+_loaded_files = {}
+_loaded_files_lock = threading.Lock()
+
+
+def _load_file(file: Path, load):
+    if not isinstance(file, Path): # zip 내부 파일
+        return load(file)
+    stat = file.stat()
+    key = (str(file.absolute()), load)
+    with _loaded_files_lock:
+        stamp, value = _loaded_files.get(key, (None, None))
+    if stamp == (stat.st_size, stat.st_mtime_ns):
+        return value
+    value = load(file)
+    with _loaded_files_lock:
+        _loaded_files[key] = ((stat.st_size, stat.st_mtime_ns), value)
+    return value
+
+
+def _read_text(file: Path):
+    with open(file, 'rt', encoding='utf-8') as f:
+        return f.read()
+
+
+def _render_report(text_form: str, metrics, variants):
+    import table_processor # pylint: disable=import-outside-toplevel
+
+    coverage_metrics, headers, genomic_instability = metrics
+    genomic_instability_metric, genomic_instability_status = genomic_instability
+    snv, cnv, fusion = variants
     mut_info, amp_info, fus_info, sig_genes = table_processor.generate_printable_gene_info(snv, cnv, fusion)
 
     # 검사결과
@@ -114,10 +381,10 @@ def run(source_file: Path, dest_dir, case_name):
     sig_genes = ', '.join(sig_genes)
     # mut_sig, amp_sig, fus_sig, mut_unk, amp_unk, fus_unk
 
-    def _filter_significant_tier(df: DataFrame):
+    def _filter_significant_tier(df: 'DataFrame'):
         return df.loc[df[Col.TIER] <= Tier.TIER_1_2]
     
-    def _has_low_read(df: DataFrame):
+    def _has_low_read(df: 'DataFrame'):
         return not df.query("`Total Read` < 500").empty
     
     fus_low_read_note = 'Note) fusion read 수가 낮아 위양성의 가능성이 있으므로 해석과 임상 적용에 주의가 필요합니다.'
@@ -148,10 +415,6 @@ def run(source_file: Path, dest_dir, case_name):
     ]
     assert len(print_params) == 22
 
-    format_file = Path('resources/report_text_format.txt')
-    with open(format_file, 'rt', encoding='utf-8') as f:
-        text_form = f.read()
-    
     full_text = text_form.format(cellularity, mut_sig, amp_sig, fus_sig, fus_sig_note,
         mut_unk, amp_unk, fus_unk, fus_unk_note,
         tumor_mutational_burden, msi_score, msi_status, loh,
@@ -160,20 +423,17 @@ def run(source_file: Path, dest_dir, case_name):
         overall_qc_test_result, qc_note)
     # wrapped_text = textwrap.fill(full_text, width=80, expand_tabs=False,
     #                              replace_whitespace=False, drop_whitespace=False)
-
-    report_file = dest_dir / f'{case_name}_report.txt'
-    with open(report_file, 'wt', encoding='utf-8') as f:
-        f.write(full_text)
-        # f.write(wrapped_text)
-    print(f'Generated report text file: {report_file}')
+    return full_text
 
 
-def _diff_table(op1: DataFrame, op2: DataFrame):
+def _diff_table(op1: 'DataFrame', op2: 'DataFrame'):
     index = op1.index.name
     return op1[~op1.index.isin(op2.index)]
 
 
-def _print_table(df: DataFrame):
+def _print_table(df: 'DataFrame'):
+    from numpy import nan # pylint: disable=import-outside-toplevel
+    from tabulate import tabulate # pylint: disable=import-outside-toplevel
     return tabulate(df.replace(nan, None), headers=df.columns.tolist(),
                     showindex=False) + ('\nNot Found' if df.empty else '')
 
@@ -188,23 +448,251 @@ def _parse_case_name(file_name: str):
     # return match.group()
 
 
+def _is_fusion_file(source_file: Path):
+    return source_file.stem.split('_')[0].endswith('R')
+
+
+def find_case_files(sources: list[Path]):
+    files = []
+    for source in sources:
+        if source.is_dir():
+            files.extend(sorted(source.glob('*.zip')))
+        elif glob.has_magic(str(source)):
+            files.extend(sorted(Path(x) for x in glob.glob(str(source))))
+        else:
+            files.append(source)
+    # R(fusion) zip은 D zip 처리 시 find_fusion_file로 함께 읽음
+    return [x for x in dict.fromkeys(files)
+            if x.suffix == '.zip' and not _is_fusion_file(x)]
+
+
+def _run_case(source_file: Path, output_dir: Path, options: RunOptions):
+    case_name = _parse_case_name(source_file.stem)
+    try:
+        run(source_file, output_dir / case_name, case_name, options)
+    except Exception: # pylint: disable=broad-exception-caught
+        return case_name, traceback.format_exc()
+    return case_name, None
+
+
+# 실행 중인 케이스를 workers개로 제한해, 작업 프로세스가 죽으면(OOM kill 등) 그때 실행 중이던
+# 케이스와 아직 시작하지 않은 케이스를 구분해 반환
+def _run_on_pool(source_files: list[Path], output_dir: Path, workers: int,
+                 options: RunOptions, report):
+    waiting = list(source_files)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while waiting or running:
+            while waiting and len(running) < workers:
+                source_file = waiting.pop(0)
+                running[executor.submit(_run_case, source_file, output_dir, options)] = source_file
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            crashed = []
+            for future in done:
+                source_file = running.pop(future)
+                try:
+                    case_name, error = future.result()
+                except BrokenProcessPool:
+                    crashed.append(source_file)
+                    continue
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    case_name, error = _parse_case_name(source_file.stem), repr(e)
+                report(source_file, case_name, error)
+            if crashed:
+                return crashed + list(running.values()), waiting
+    return [], []
+
+
+def run_batch(source_files: list[Path], output_dir: Path, workers: int = None,
+              options: RunOptions = None):
+    workers = workers or os.cpu_count()
+    failures = {}
+
+    def report(source_file, case_name, error):
+        if error is None:
+            print(f'[OK] {case_name}')
+        else:
+            failures[case_name] = error
+            print(f'[FAILED] {case_name} ({source_file})\n{error}')
+
+    remaining = list(source_files)
+    while remaining:
+        crashed, remaining = _run_on_pool(remaining, output_dir, workers, options, report)
+        # 어느 케이스가 프로세스를 죽였는지 알 수 없으므로 하나씩 따로 다시 실행
+        for source_file in crashed:
+            if _run_on_pool([source_file], output_dir, 1, options, report)[0]:
+                report(source_file, _parse_case_name(source_file.stem),
+                       'Worker process terminated abruptly (killed or crashed)')
+
+    print(f'Batch finished: {len(source_files) - len(failures)} succeeded,'
+          f' {len(failures)} failed.')
+    for case_name in sorted(failures):
+        print(f' - {case_name}')
+    return failures
+
+
+def _resource_dir():
+    # pyinstaller 임시 폴더(one-file) 또는 실행 파일 폴더(one-folder), 소스 실행 시 이 파일 위치
+    return getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
+
+
+def _print_import_timeline():
+    print(f'Entry point import: {_ENTRY_IMPORT_TIME * 1000:.0f} ms'
+          f' (budget {ENTRY_IMPORT_BUDGET * 1000:.0f} ms)')
+    total = 0
+    for module in HEAVY_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            print(f'  {module:<16} not installed')
+            continue
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        print(f'  {module:<16} {elapsed * 1000:8.0f} ms')
+    print(f'Heavy module imports: {total * 1000:.0f} ms,'
+          f' since start: {(time.perf_counter() - _START_TIME) * 1000:.0f} ms')
+
+
 def main():
+    multiprocessing.freeze_support()
     print("Starting oncomine report generator.")
 
-    if len(sys.argv) != 2:
-        sys.exit('Please check arguments number.\n'\
-                 + 'Usage: run.exe Mxx-xxxx.zip')
-    source_file = Path(sys.argv[1]).absolute()
-    # dest_path = sys.argv[2]
-    print(f'File path: {source_file}')
-    case_name = _parse_case_name(source_file.stem)
+    parser = argparse.ArgumentParser(
+        prog='run.exe',
+        usage='run.exe Mxx-xxxx.zip | run.exe [-j N] <folder|zip|glob> ...'
+        ' | run.exe --queue DIR [<folder|zip|glob> ...] [--work] [--status]'
+        ' | run.exe --serve [--port PORT]')
+    parser.add_argument('sources', nargs='*', type=Path,
+                        help='case zip file(s), glob pattern(s) or export folder(s)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes in batch mode'
+                        ' (default: number of CPUs)')
+    parser.add_argument('--extract-all', action='store_true',
+                        help='extract every file of the zip, not only the files'
+                        ' used for the report')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='read the input files straight from the zip'
+                        ' without extracting them')
+    parser.add_argument('--cache-dir', type=Path, default=None,
+                        help=f'cache directory (default: {CACHE_DIR_NAME} next to'
+                        ' the case folders)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='recompute every stage instead of reusing cached results')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='maximum size of the stage cache in MB')
+    parser.add_argument('--stage-workers', type=int, default=4,
+                        help='threads running independent stages of a case concurrently')
+    parser.add_argument('--memory-limit', type=int, default=None, metavar='MB',
+                        help='memory ceiling per case: read the oncomine tables in'
+                        ' chunks keeping only reportable rows, with compact dtypes'
+                        f' (at least {MIN_MEMORY_LIMIT_MB}, the limit also covers the loaded'
+                        ' modules and stage threads)')
+    parser.add_argument('--cohort-db', type=Path, default=None,
+                        help='append the variant tables of each case to this SQLite'
+                        ' cohort store (query it with cohort_store.py)')
+    parser.add_argument('--profile', action='store_true',
+                        help='save a cProfile dump of each stage next to the report')
+    parser.add_argument('--report-only', action='store_true',
+                        help='write only the report text, skipping the nocall tables and'
+                        ' the filtered data workbook (run again without it to add them)')
+    parser.add_argument('--table-format', choices=table_formats,
+                        default='xlsx',
+                        help='format of the intermediate filtered data tables')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep watching the given export folder and process new'
+                        ' case zips as they land')
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help='seconds between folder scans in watch and queue worker mode')
+    parser.add_argument('--fusion-wait', type=float, default=600,
+                        help='seconds to wait for the R(fusion) zip in watch mode')
+    parser.add_argument('--queue', type=Path, default=None, metavar='DIR',
+                        help='shared job queue folder: add the given cases to the queue'
+                        ' instead of processing them')
+    parser.add_argument('--queue-output', type=Path, default=Path('output'), metavar='DIR',
+                        help='output folder of queued cases, relative to the --queue folder'
+                        ' unless absolute (must be reachable from every worker PC)')
+    parser.add_argument('--work', action='store_true',
+                        help='process cases from the --queue folder with -j processes'
+                        ' (together with workers on other PCs)')
+    parser.add_argument('--drain', action='store_true',
+                        help='with --work, exit when no case is left in the queue')
+    parser.add_argument('--status', action='store_true',
+                        help='print the state of every case in the --queue folder')
+    parser.add_argument('--serve', action='store_true',
+                        help='keep running as a local report server (http://127.0.0.1:PORT)'
+                        ' with the modules, template and blacklist loaded')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='port of the report server')
+    parser.add_argument('--import-timeline', action='store_true',
+                        help='print how long the entry point and each heavy module'
+                        ' take to import')
+    args = parser.parse_args()
+    if args.memory_limit is not None and args.memory_limit < MIN_MEMORY_LIMIT_MB:
+        parser.error(f'--memory-limit must be at least {MIN_MEMORY_LIMIT_MB} MB')
+    if args.import_timeline:
+        _print_import_timeline()
+    options = RunOptions(extract_all=args.extract_all, in_memory=args.in_memory,
+                         cache_dir=args.cache_dir and args.cache_dir.absolute(),
+                         table_format=args.table_format,
+                         stage_cache=not args.no_cache, cache_max_mb=args.cache_size,
+                         stage_workers=args.stage_workers,
+                         memory_limit_mb=args.memory_limit,
+                         cohort_db=args.cohort_db and args.cohort_db.absolute(),
+                         profile=args.profile, report_only=args.report_only)
+
+    output_dir = Path(os.getcwd()).absolute()
+    if args.serve:
+        import server # pylint: disable=import-outside-toplevel
+        os.chdir(_resource_dir())
+        server.serve(output_dir, options, args.port)
+        return
+    if args.queue is not None:
+        import job_queue # pylint: disable=import-outside-toplevel
+        queue = job_queue.JobQueue(args.queue.absolute())
+        for source_file in find_case_files([x.absolute() for x in args.sources]):
+            queue.enqueue(source_file, args.queue_output)
+        if args.status:
+            queue.print_status()
+        if args.work:
+            os.chdir(_resource_dir())
+            job_queue.work(queue, options, args.workers, args.poll_interval, args.drain)
+        return
+    if not args.sources:
+        parser.error('the following arguments are required: sources')
+
+    if args.watch:
+        import watcher # pylint: disable=import-outside-toplevel
+        if len(args.sources) != 1 or not args.sources[0].is_dir():
+            sys.exit('Watch mode needs exactly one export folder.')
+        os.chdir(_resource_dir())
+        watcher.FolderWatcher(args.sources[0].absolute(), output_dir, options,
+                              args.workers, args.poll_interval,
+                              fusion_wait=args.fusion_wait).run_forever()
+        return
+
+    if len(args.sources) == 1 and args.sources[0].is_file():
+        source_file = args.sources[0].absolute()
+        # dest_path = sys.argv[2]
+        print(f'File path: {source_file}')
+        case_name = _parse_case_name(source_file.stem)
+
+        dest_dir = output_dir / case_name
+        os.chdir(_resource_dir())
+        print(f'Destination path: {dest_dir}')
+        print(f'Case name: {case_name}')
+        run(source_file, dest_dir, case_name, options)
+        return
+
+    source_files = find_case_files([x.absolute() for x in args.sources])
+    if not source_files:
+        sys.exit('No case zip file found.')
+    print(f'Cases to process: {len(source_files)}')
+    os.chdir(_resource_dir())
+    failures = run_batch(source_files, output_dir, args.workers, options)
+    if failures:
+        sys.exit(1)
 
-    dest_dir = Path(os.getcwd(), case_name).absolute()
-    os.chdir(getattr(sys, '_MEIPASS')) # pyinstaller temporary dir
-    print(f'Destination path: {dest_dir}')
-    print(f'Case name: {case_name}')
-    run(source_file, dest_dir, case_name)
-    
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,65 @@
 import sys
-from zipfile import ZipFile
-from pathlib import Path
+import os
+import json
+from contextlib import contextmanager
+from zipfile import ZipFile, ZipInfo
+from pathlib import Path, PurePosixPath
+from concurrent.futures import ThreadPoolExecutor
+
+import stage_trace
+
+
+# 압축을 풀지 않고 zip 내부 파일을 직접 읽기 위한 참조
+class ArchiveMember:
+    def __init__(self, archive: Path, zipinfo: ZipInfo):
+        self.archive = archive
+        self.member = zipinfo.filename
+        self.crc = zipinfo.CRC
+        self.file_size = zipinfo.file_size
+        self.path = PurePosixPath(zipinfo.filename.replace(':', '-'))
+        self.name = self.path.name
+        self.suffix = self.path.suffix
+
+    @contextmanager
+    def open(self):
+        with ZipFile(self.archive, 'r') as zipdata, zipdata.open(self.member) as f:
+            yield f
+
+    def __str__(self):
+        return f'{self.archive}!{self.path}'
+
+
+@contextmanager
+def open_input(file):
+    if isinstance(file, ArchiveMember):
+        with file.open() as f:
+            yield f
+    else:
+        with open(file, 'rb') as f:
+            yield f
+
+
+def read_json(file: Path):
+    try:
+        with open(file, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# strict가 아니면 캐시 파일처럼 쓰지 못해도 계속 진행
+def write_json_atomic(file: Path, data, strict: bool = False):
+    temp_file = file.with_name(f'{file.name}.{os.getpid()}.tmp')
+    try:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_file, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_file, file)
+    except OSError as e:
+        temp_file.unlink(missing_ok=True)
+        if strict:
+            raise
+        print(f'Could not write cache file {file}: {e}')
 
 
 def find_fusion_file(dir: Path, case_name: Path):
@@ -9,26 +68,70 @@ def find_fusion_file(dir: Path, case_name: Path):
                 x.name.startswith((case_name + 'R', case_name + '-R'))), None)
 
 
-# 윈도우에서 인식하지 못하는 파일명 내 : 문자를 -로 변경
-def unzip_to_destination_and_normalize(source_file: Path, dest_dir: Path):
-    if not dest_dir.exists():
-        dest_dir.mkdir(parents=True, exist_ok=True)
+# find_target_files에서 사용하는 파일만 추출 대상 (BAM 등 제외)
+def is_target_member(name: str):
+    path = PurePosixPath(name)
+    if path.parts[0] == 'Variants':
+        return path.name.endswith('-oncomine.tsv') or path.name.endswith(('.vcf', '.vcf.gz'))
+    if path.parts[0] == 'QC':
+        return path.suffix == '.pdf'
+    return name == 'CnvActor/TumorFraction/tumor_fraction.json'
 
+
+def _extract_member(source_file: Path, zipinfo: ZipInfo, dest_dir: Path):
     with ZipFile(source_file, 'r') as zipdata:
-        zipinfos = zipdata.infolist()
-        for zipinfo in zipinfos:
-            zipinfo.filename = zipinfo.filename.replace(':', '-')
-            if not Path(dest_dir, zipinfo.filename).exists():
-                zipdata.extract(zipinfo, dest_dir)
+        zipdata.extract(zipinfo, dest_dir)
+
+
+# 윈도우에서 인식하지 못하는 파일명 내 : 문자를 -로 변경
+def unzip_to_destination_and_normalize(source_file: Path, dest_dir: Path,
+                                       selective=False, workers=1):
+    with stage_trace.stage('unzip', archive=source_file.name) as record:
+        if not dest_dir.exists():
+            dest_dir.mkdir(parents=True, exist_ok=True)
+
+        with ZipFile(source_file, 'r') as zipdata:
+            zipinfos = zipdata.infolist()
+            for zipinfo in zipinfos:
+                zipinfo.filename = zipinfo.filename.replace(':', '-')
+            if selective:
+                zipinfos = [x for x in zipinfos
+                            if not x.is_dir() and is_target_member(x.filename)]
+            zipinfos = [x for x in zipinfos
+                        if not Path(dest_dir, x.filename).exists()]
+            record['files'] = len(zipinfos)
+            if workers <= 1 or len(zipinfos) <= 1:
+                for zipinfo in zipinfos:
+                    zipdata.extract(zipinfo, dest_dir)
+                zipinfos = []
+
+        if zipinfos:
+            # ZipFile.extract의 폴더 생성은 스레드 간 경쟁 시 FileExistsError가 나므로 미리 생성
+            for directory in {Path(dest_dir, x.filename).parent for x in zipinfos}:
+                directory.mkdir(parents=True, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda x: _extract_member(source_file, x, dest_dir),
+                                  zipinfos))
     
     print(f'Unzipped the file [{source_file}] to directory [{dest_dir}].')
 
 
 
+# blacklist.xlsx, tier_rules.json 등 케이스 폴더 상위에 두는 설정 파일
+def _find_site_file(root: Path, name: str):
+    site_file = root.parent / name
+    return site_file if site_file.exists() else None
+
+
+def find_site_files(root: Path):
+    return {
+        'BLACKLIST_FILE': _find_site_file(root, "blacklist.xlsx"),
+        'TIER_RULES_FILE': _find_site_file(root, "tier_rules.json"),
+        'ANNOTATION_INDEX_FILE': _find_site_file(root, "annotation_index.json")
+    }
+
+
 def find_target_files(root: Path):
-    blacklist_file = root.parent / "blacklist.xlsx"
-    if not blacklist_file.exists():
-        blacklist_file = None
     case_name = root.name
     variants_dir = root / 'Variants'
     D_variants_case_dir = next(x for x in variants_dir.iterdir()
@@ -38,7 +141,7 @@ def find_target_files(root: Path):
                 if x.is_file and x.name.startswith(case_name)]
     D_oncomine_file = next(x for x in targets if x.name.endswith('-oncomine.tsv'))
 
-    vcf_file = next(x for x in targets if x.suffix == '.vcf')
+    vcf_file = next(x for x in targets if x.name.endswith(('.vcf', '.vcf.gz')))
     qc_dir = root / 'QC'
     qc_file = next(x for x in qc_dir.iterdir()
                    if x.suffix == ('.pdf') and x.name.startswith(case_name))
@@ -61,5 +164,41 @@ def find_target_files(root: Path):
         'VCF_FILE': vcf_file,
         'QC_FILE': qc_file,
         'TUMOR_FRACTION_FILE': tumor_fraction_file,
-        'BLACKLIST_FILE': blacklist_file
+        **find_site_files(root)
+    }
+
+
+def find_target_members(source_files: list[Path], root: Path):
+    case_name = root.name
+    members = []
+    for source_file in source_files:
+        with ZipFile(source_file, 'r') as zipdata:
+            members.extend(ArchiveMember(source_file, x)
+                           for x in zipdata.infolist() if not x.is_dir())
+
+    def variants_case_files(case_dir_prefixes):
+        return [x for x in members
+                if len(x.path.parts) == 3 and x.path.parts[0] == 'Variants'
+                and x.path.parts[1].startswith(case_dir_prefixes)
+                and x.name.startswith(case_name)]
+
+    targets = variants_case_files((case_name + 'D', case_name + '-D'))
+    D_oncomine_file = next((x for x in targets if x.name.endswith('-oncomine.tsv')), None)
+    vcf_file = next((x for x in targets if x.name.endswith(('.vcf', '.vcf.gz'))), None)
+    qc_file = next((x for x in members
+                    if x.path.parent == PurePosixPath('QC') and
+                    x.suffix == '.pdf' and x.name.startswith(case_name)), None)
+    tumor_fraction_file = next((x for x in members
+                                if x.path == PurePosixPath('CnvActor/TumorFraction/tumor_fraction.json')), None)
+
+    targets = variants_case_files((case_name + 'R', case_name + '-R'))
+    R_oncomine_file = next((x for x in targets if x.name.endswith('-oncomine.tsv')), None)
+
+    return {
+        'ONCOMINE_D_FILE': D_oncomine_file,
+        'ONCOMINE_R_FILE': R_oncomine_file,
+        'VCF_FILE': vcf_file,
+        'QC_FILE': qc_file,
+        'TUMOR_FRACTION_FILE': tumor_fraction_file,
+        **find_site_files(root)
     }
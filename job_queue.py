@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import socket
+import traceback
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import file_processor
+from core import RunOptions, _run_case, _parse_case_name
+
+states = ['pending', 'claimed', 'done', 'failed']
+
+
+# 여러 PC가 같은 네트워크 공유 폴더를 큐로 사용 (SQLite 잠금은 SMB에서 믿을 수 없어 파일 이름 변경 사용)
+# <queue_dir>/<state>/<case>.json
+# - claim: pending -> claimed 이름 변경, 같은 파일은 한 worker만 성공
+# - heartbeat: 처리 중인 claimed 파일의 내용을 다시 써서 수정 시각을 주기적으로 갱신
+# - lease보다 오래 갱신되지 않은 claimed 파일은 worker가 죽은 것으로 보고 다시 pending으로
+# - 실패하면 backoff * 2^(시도 횟수 - 1)초 뒤에 재시도, max_attempts번 실패하면 failed
+# - 입력 zip과 결과 폴더는 모든 PC에서 같은 위치여야 하므로 큐 폴더 기준 상대 경로로 저장
+#   (결과 폴더 기본값 output, 큐 폴더와 같은 공유 폴더에 없는 zip은 추가하지 않음)
+class JobQueue:
+    def __init__(self, queue_dir: Path, lease: float = 300, backoff: float = 60,
+                 max_attempts: int = 3):
+        self.queue_dir = queue_dir
+        self.lease = lease
+        self.backoff = backoff
+        self.max_attempts = max_attempts
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        for state in states:
+            (queue_dir / state).mkdir(parents=True, exist_ok=True)
+
+    def _file(self, state: str, case_name: str):
+        return self.queue_dir / state / f'{case_name}.json'
+
+    def _write(self, file: Path, job: dict):
+        # 다른 PC와 이름이 겹치지 않는 임시 파일에 쓴 뒤 교체 (*.json만 job으로 취급)
+        temp_file = file.with_name(f'{file.name}.{socket.gethostname()}.{os.getpid()}.tmp')
+        with open(temp_file, 'wt', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, file)
+
+    # PC마다 시계가 다를 수 있으므로 수정 시각 비교에는 공유 폴더 서버의 시각을 사용
+    # (touch/utime은 SMB에서 client 시각을 그대로 설정하므로 내용을 써서 서버가 기록하게 함)
+    def share_time(self):
+        clock_file = self.queue_dir / f'.clock.{socket.gethostname()}'
+        clock_file.write_text(f'{self.worker_id} {time.time()}', encoding='utf-8')
+        return clock_file.stat().st_mtime
+
+    # 같은 내용을 제자리에 다시 써서 수정 시각만 갱신 (다른 worker가 읽어도 항상 온전한 JSON)
+    @staticmethod
+    def _touch(file: Path):
+        with open(file, 'r+b') as f:
+            data = f.read()
+            f.seek(0)
+            f.write(data)
+
+    def output_dir(self, job: dict):
+        return self.queue_dir / job['output_dir']
+
+    def source_file(self, job: dict):
+        return Path(os.path.normpath(self.queue_dir / job['file']))
+
+    # 큐 폴더와 같은 공유 폴더(드라이브, 파일 시스템)에 있으면 큐 폴더 기준 상대 경로
+    def _relative_to_queue(self, file: Path):
+        try:
+            if file.stat().st_dev != self.queue_dir.stat().st_dev:
+                return None
+            return os.path.relpath(file, self.queue_dir)
+        except ValueError: # 윈도우에서 드라이브가 다른 경우
+            return None
+
+    def enqueue(self, source_file: Path, output_dir: Path = Path('output'), force: bool = False):
+        case_name = _parse_case_name(source_file.stem)
+        relative_file = self._relative_to_queue(source_file)
+        if relative_file is None:
+            print(f'Not on the queue share, other workers cannot read it: {source_file}')
+            return False
+        stat = source_file.stat()
+        source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if self._file('pending', case_name).exists() or self._file('claimed', case_name).exists():
+            print(f'Already queued: {case_name}')
+            return False
+        done = file_processor.read_json(self._file('done', case_name))
+        if not force and done is not None and done['source'] == source:
+            print(f'Already processed: {case_name}')
+            return False
+        job = {'case': case_name, 'file': relative_file, 'output_dir': str(output_dir),
+               'source': source, 'attempts': 0, 'not_before': 0, 'worker': None,
+               'error': None, 'enqueued': datetime.now().isoformat(timespec='seconds')}
+        self._write(self._file('pending', case_name), job)
+        self._file('failed', case_name).unlink(missing_ok=True)
+        print(f'Queued: {case_name}')
+        return True
+
+    def claim(self):
+        now = self.share_time()
+        for file in sorted(self.queue_dir.glob('pending/*.json'), key=os.path.getmtime):
+            job = file_processor.read_json(file)
+            if job is None or job['not_before'] > now:
+                continue
+            claimed_file = self._file('claimed', job['case'])
+            try:
+                self._touch(file) # 이름 변경 직후 lease 만료로 판단되지 않도록
+                os.rename(file, claimed_file)
+            except OSError:
+                continue # 다른 worker가 먼저 가져감
+            job['worker'] = self.worker_id
+            job['claimed'] = datetime.now().isoformat(timespec='seconds')
+            self._write(claimed_file, job)
+            return job
+        return None
+
+    def heartbeat(self, job: dict):
+        try:
+            self._touch(self._file('claimed', job['case']))
+        except OSError:
+            print(f'Lost the lease of {job["case"]}')
+
+    # 실패 또는 lease 만료: 재시도 대기열로 되돌리거나 failed로 이동
+    def _retry(self, job: dict, file: Path, error: str):
+        job['attempts'] += 1
+        job['error'] = error
+        job['worker'] = None
+        if job['attempts'] >= self.max_attempts:
+            state = 'failed'
+        else:
+            state = 'pending'
+            job['not_before'] = self.share_time() + self.backoff * 2 ** (job['attempts'] - 1)
+        self._write(file, job)
+        os.replace(file, self._file(state, job['case']))
+        return state
+
+    def finish(self, job: dict, error: str = None):
+        claimed_file = self._file('claimed', job['case'])
+        current = file_processor.read_json(claimed_file)
+        if current is None or current['worker'] != self.worker_id:
+            print(f'Job of {job["case"]} was taken over by another worker, result not recorded.')
+            return None
+        if error is not None:
+            return self._retry(job, claimed_file, error)
+        job['error'] = None
+        job['finished'] = datetime.now().isoformat(timespec='seconds')
+        self._write(claimed_file, job)
+        os.replace(claimed_file, self._file('done', job['case']))
+        return 'done'
+
+    def reclaim_expired(self):
+        now = self.share_time()
+        for file in self.queue_dir.glob('claimed/*.json'):
+            try:
+                if now - file.stat().st_mtime < self.lease:
+                    continue
+                # 여러 worker가 동시에 발견해도 이름 변경은 하나만 성공
+                taken = file.with_name(f'{file.name}.{socket.gethostname()}.{os.getpid()}.expired')
+                os.rename(file, taken)
+            except OSError:
+                continue
+            job = file_processor.read_json(taken)
+            if job is None:
+                taken.unlink(missing_ok=True)
+                continue
+            state = self._retry(job, taken, f'Lease expired (worker {job["worker"]})')
+            print(f'Reclaimed {job["case"]} from a stale worker -> {state}')
+
+    def jobs(self):
+        for state in states:
+            for file in sorted(self.queue_dir.glob(f'{state}/*.json')):
+                job = file_processor.read_json(file)
+                if job is not None:
+                    yield state, job, file.stat().st_mtime
+
+    def print_status(self):
+        now = self.share_time()
+        counts = dict.fromkeys(states, 0)
+        for state, job, mtime in self.jobs():
+            counts[state] += 1
+            if state == 'done':
+                continue
+            detail = ''
+            if state == 'claimed':
+                detail = f'{job["worker"]}, heartbeat {now - mtime:.0f}s ago'
+            elif state == 'pending' and job['not_before'] > now:
+                detail = f'retry in {job["not_before"] - now:.0f}s'
+            error = (job['error'] or '').strip().splitlines()
+            if error:
+                detail += f' | {error[-1]}'
+            print(f'  {state:<8} {job["case"]:<16} attempts {job["attempts"]}  {detail}')
+        print(', '.join(f'{state}: {count}' for state, count in counts.items()))
+
+
+CRASHED = 'Worker process terminated abruptly (killed or crashed)'
+
+
+def _report(queue: JobQueue, job: dict, error: str):
+    state = queue.finish(job, error)
+    if error is None:
+        print(f'[OK] {job["case"]}')
+    else:
+        print(f'[FAILED] {job["case"]} -> {state}\n{error}')
+
+
+# 큐가 비면 True, 작업 프로세스가 죽어 pool을 더 사용할 수 없으면 False
+# (어느 job 때문인지 알 수 없으므로 실행 중이던 job은 모두 재시도 대기열로 되돌림)
+def _work_on_pool(queue: JobQueue, executor: ProcessPoolExecutor, options: RunOptions,
+                  workers: int, poll_interval: float, drain: bool):
+    heartbeat_interval = min(poll_interval, queue.lease / 3)
+    running = {}
+    while True:
+        queue.reclaim_expired()
+        while len(running) < workers:
+            job = queue.claim()
+            if job is None:
+                break
+            print(f'Claimed {job["case"]} (attempt {job["attempts"] + 1})')
+            try:
+                future = executor.submit(_run_case, queue.source_file(job),
+                                         queue.output_dir(job), options)
+            except BrokenProcessPool:
+                for crashed in [job, *running.values()]:
+                    _report(queue, crashed, CRASHED)
+                return False
+            running[future] = job
+        if not running:
+            # 재시도 대기 중인 job도 끝날 때까지 기다림 (다른 PC가 처리 중인 job은 제외)
+            if drain and not any(queue.queue_dir.glob('pending/*.json')):
+                return True
+            time.sleep(poll_interval)
+            continue
+
+        done, _ = wait(running, timeout=heartbeat_interval, return_when=FIRST_COMPLETED)
+        crashed = []
+        for future in done:
+            job = running.pop(future)
+            try:
+                _, error = future.result()
+            except BrokenProcessPool:
+                crashed.append(job)
+                continue
+            except Exception: # pylint: disable=broad-exception-caught
+                error = traceback.format_exc()
+            _report(queue, job, error)
+        if crashed:
+            for job in crashed + list(running.values()):
+                _report(queue, job, CRASHED)
+            return False
+        for job in running.values():
+            queue.heartbeat(job)
+
+
+# 한 PC에서 workers개 프로세스로 큐를 처리, drain이면 처리할 job이 없을 때 종료
+def work(queue: JobQueue, options: RunOptions = None, workers: int = None,
+         poll_interval: float = 10, drain: bool = False):
+    workers = workers or os.cpu_count()
+    print(f'Worker {queue.worker_id} processing queue [{queue.queue_dir}] with {workers} processes.')
+    while True:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            if _work_on_pool(queue, executor, options, workers, poll_interval, drain):
+                break
+        print('A worker process died, restarting the process pool.')
+    print('Queue drained.')
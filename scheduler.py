@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import stage_trace
+
+
+# 의존 관계가 없는 단계를 스레드 풀에서 동시에 실행
+# task 함수는 deps 순서대로 선행 task의 결과를 인자로 받음
+class Scheduler:
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.tasks = {} # {이름: (함수, 선행 task 이름)}
+        self.results = {}
+        self.timings = {} # {이름: (시작, 종료)} run() 시작 기준 초
+        self._start = None
+
+    def add(self, name: str, func, *deps: str):
+        self.tasks[name] = (func, deps)
+
+    def _call(self, name: str):
+        func, deps = self.tasks[name]
+        start = time.perf_counter() - self._start
+        with stage_trace.stage(name):
+            result = func(*(self.results[x] for x in deps))
+        self.timings[name] = (start, time.perf_counter() - self._start)
+        return result
+
+    def run(self):
+        self._start = time.perf_counter()
+        remaining = dict(self.tasks)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while remaining or running:
+                ready = [x for x, (_, deps) in remaining.items()
+                         if all(d in self.results for d in deps)]
+                for name in ready:
+                    del remaining[name]
+                    running[executor.submit(self._call, name)] = name
+                if not running:
+                    raise ValueError(f'Unresolvable task dependencies: {list(remaining)}')
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self.results[name] = future.result()
+        return self.results
+
+    # 가장 늦게 끝난 task부터 가장 늦게 끝난 선행 task를 따라간 경로
+    def critical_path(self):
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda x: self.timings[x][1])
+        path = [name]
+        while self.tasks[name][1]:
+            name = max(self.tasks[name][1], key=lambda x: self.timings[x][1])
+            path.append(name)
+        return path[::-1]
+
+    def summary(self):
+        path = self.critical_path()
+        return {
+            'workers': self.workers,
+            'wall_seconds': round(max((x[1] for x in self.timings.values()), default=0), 6),
+            'task_seconds': round(sum(x[1] - x[0] for x in self.timings.values()), 6),
+            'critical_path': [{'name': x, 'seconds': round(self.timings[x][1] - self.timings[x][0], 6)}
+                              for x in path]
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        path = ' -> '.join(f'{x["name"]} ({x["seconds"]:.2f}s)'
+                           for x in summary['critical_path'])
+        print(f'Stages finished in {summary["wall_seconds"]:.2f}s'
+              f' (sum of stages {summary["task_seconds"]:.2f}s, {self.workers} workers).'
+              f' Critical path: {path}')
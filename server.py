@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import importlib
+import threading
+import traceback
+import dataclasses
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from pathlib import Path
+
+import core
+from core import RunOptions, _parse_case_name, _is_fusion_file
+from constants import table_formats
+
+DEFAULT_PORT = 8765
+UPLOAD_CHUNK = 1 << 20
+# 프로세스 전역 설정이라 요청마다 바꿀 수 없는 옵션 (서버 시작 시에만 지정)
+fixed_options = {'memory_limit_mb'}
+
+
+# 상주 모드: 무거운 모듈 import와 보고서 양식/blacklist/tier 규칙 읽기를 한 번만 하고
+# 케이스마다 계산 시간만 사용
+# GET  /status
+# POST /run                        {"file": "<D zip 경로>", "output_dir": ..., "options": {...}}
+# POST /upload?name=<zip 이름>     body: zip 파일 (R zip은 D zip보다 먼저 올리면 함께 처리)
+class ReportServer(ThreadingHTTPServer):
+    def __init__(self, port: int, output_dir: Path, options: RunOptions):
+        # 인증이 없으므로 이 PC에서만 접속 가능하게 함
+        super().__init__(('127.0.0.1', port), RequestHandler)
+        self.output_dir = output_dir
+        self.options = options
+        self.upload_dir = output_dir / 'uploads'
+        # stage_trace와 작업 폴더는 프로세스 전역이므로 케이스는 한 번에 하나씩 처리
+        self.run_lock = threading.Lock()
+        self.started = time.time()
+        self.cases_run = 0
+
+    def run_options(self, overrides: dict):
+        names = {x.name for x in dataclasses.fields(RunOptions)}
+        unknown = set(overrides) - names
+        if unknown:
+            raise ValueError(f'Unknown options: {sorted(unknown)}')
+        fixed = set(overrides) & fixed_options
+        if fixed:
+            raise ValueError(f'Options that cannot be set per request: {sorted(fixed)}')
+        fields = {x.name: x for x in dataclasses.fields(RunOptions)}
+        for name, value in overrides.items():
+            _check_option(fields[name], value)
+            if fields[name].type is Path and value is not None:
+                overrides[name] = Path(value)
+        return dataclasses.replace(self.options, **overrides)
+
+    def run_case(self, source_file: Path, output_dir: Path, options: RunOptions):
+        case_name = _parse_case_name(source_file.stem)
+        dest_dir = output_dir / case_name
+        with self.run_lock:
+            start = time.perf_counter()
+            tracer = core.run(source_file, dest_dir, case_name, options)
+            seconds = time.perf_counter() - start
+            self.cases_run += 1
+        report_file = dest_dir / f'{case_name}_report.txt'
+        workbook = dest_dir / f'{case_name}_filtered_data.xlsx'
+        if options.table_format != 'xlsx':
+            workbook = workbook.with_suffix('')
+        return {'case': case_name,
+                'report': report_file.read_text(encoding='utf-8'),
+                'report_file': str(report_file),
+                'workbook': None if options.report_only else str(workbook),
+                'seconds': round(seconds, 3),
+                'trace': tracer.summary()}
+
+    # 큰 zip도 메모리에 모두 올리지 않도록 UPLOAD_CHUNK씩 임시 파일에 씀
+    def save_upload(self, name: str, stream, length: int):
+        file = self.upload_dir / Path(name).name
+        if file.suffix != '.zip':
+            raise ValueError(f'Not a zip file name: {name}')
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        temp_file = file.with_name(f'{file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with open(temp_file, 'wb') as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(UPLOAD_CHUNK, remaining))
+                    if not chunk:
+                        raise ValueError(f'Upload ended {remaining} bytes early: {name}')
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            os.replace(temp_file, file)
+        finally:
+            temp_file.unlink(missing_ok=True)
+        return file
+
+
+# 잘못된 값은 케이스 실행 중 500 오류가 되지 않도록 요청 단계에서 400으로 거절
+def _check_option(field: dataclasses.Field, value):
+    if value is None and field.default is None:
+        return
+    if field.type is bool:
+        valid = isinstance(value, bool)
+    elif field.type is int:
+        valid = isinstance(value, int) and not isinstance(value, bool) and value >= 1
+    elif field.name == 'table_format':
+        valid = value in table_formats
+    else: # Path
+        valid = isinstance(value, str) and value != ''
+    if not valid:
+        raise ValueError(f'Invalid value for option {field.name}: {value!r}')
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server: ReportServer
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _content_length(self):
+        return int(self.headers.get('Content-Length', 0))
+
+    def _read_body(self):
+        return self.rfile.read(self._content_length())
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/status':
+            self._send_json(404, {'error': f'Unknown path: {self.path}'})
+            return
+        self._send_json(200, {'uptime_seconds': round(time.time() - self.server.started),
+                              'cases_run': self.server.cases_run,
+                              'busy': self.server.run_lock.locked(),
+                              'output_dir': str(self.server.output_dir)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == '/run':
+                request = json.loads(self._read_body() or b'{}')
+                source_file = Path(request['file'])
+                output_dir = Path(request.get('output_dir') or self.server.output_dir)
+                options = self.server.run_options(request.get('options') or {})
+            elif url.path == '/upload':
+                query = parse_qs(url.query)
+                source_file = self.server.save_upload(query['name'][0], self.rfile,
+                                                      self._content_length())
+                output_dir = self.server.output_dir
+                if _is_fusion_file(source_file) or query.get('run', ['1'])[0] == '0':
+                    self._send_json(200, {'saved': str(source_file)})
+                    return
+                options = self.server.options
+            else:
+                self._send_json(404, {'error': f'Unknown path: {self.path}'})
+                return
+            if not source_file.is_file():
+                self._send_json(404, {'error': f'No such file: {source_file}'})
+                return
+        except (KeyError, ValueError, TypeError) as e:
+            self._send_json(400, {'error': repr(e)})
+            return
+
+        try:
+            result = self.server.run_case(source_file.absolute(), output_dir.absolute(), options)
+        except Exception: # pylint: disable=broad-exception-caught
+            self._send_json(500, {'error': traceback.format_exc()})
+            return
+        self._send_json(200, result)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        print(f'[{self.log_date_time_string()}] {format % args}')
+
+
+def serve(output_dir: Path, options: RunOptions = None, port: int = DEFAULT_PORT):
+    for module in core.HEAVY_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    server = ReportServer(port, output_dir, options or RunOptions())
+    print(f'Serving reports on http://127.0.0.1:{port} (output: {output_dir})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,131 @@
+import os
+import sys
+import pickle
+import hashlib
+from pathlib import Path
+from zipfile import ZipFile
+
+import file_processor
+import stage_trace
+
+# 결과에 영향을 주는 모듈 (소스가 바뀌면 모든 단계 캐시 무효화)
+code_modules = ['core', 'file_processor', 'value_reader', 'table_processor', 'variants',
+                'tier_rules', 'annotation_index', 'blacklist_cache', 'workbook_writer',
+                'constants']
+
+_code_version = None
+
+
+def code_version():
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        try:
+            for module in code_modules:
+                with open(Path(__file__).with_name(f'{module}.py'), 'rb') as f:
+                    digest.update(f.read())
+        except OSError:
+            # pyinstaller 빌드에는 소스가 없으므로 실행 파일 자체로 구분
+            stat = os.stat(sys.executable)
+            digest.update(f'{sys.executable}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        _code_version = digest.hexdigest()[:16]
+    return _code_version
+
+
+# 입력 파일 내용의 식별자 (zip 내부 파일은 CRC와 크기, 일반 파일은 sha256)
+def fingerprint(file) -> str:
+    if file is None:
+        return '-'
+    if isinstance(file, file_processor.ArchiveMember):
+        return f'crc:{file.crc:08x}:{file.file_size}'
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# zip 전체를 읽지 않고 central directory의 CRC 목록으로 식별
+def zip_fingerprint(file: Path) -> str:
+    if file is None:
+        return '-'
+    digest = hashlib.sha256()
+    with ZipFile(file, 'r') as zipdata:
+        for zipinfo in zipdata.infolist():
+            digest.update(f'{zipinfo.filename}:{zipinfo.CRC}:{zipinfo.file_size}\n'.encode())
+    return digest.hexdigest()
+
+
+def stage_key(*parts) -> str:
+    digest = hashlib.sha256(code_version().encode())
+    for part in parts:
+        digest.update(b'\0' + str(part).encode())
+    return digest.hexdigest()
+
+
+# 단계 결과를 cache_dir/stages/<stage>/<key>.pkl 로 저장, 전체 크기가 max_bytes를 넘으면
+# 오래 사용하지 않은 파일부터 삭제
+class StageCache:
+    def __init__(self, cache_dir: Path, max_bytes: int = 1 << 30, enabled: bool = True):
+        self.root = cache_dir / 'stages'
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def _file(self, stage: str, key: str):
+        return self.root / stage / f'{key}.pkl'
+
+    def get(self, stage: str, key: str):
+        if not self.enabled:
+            return None
+        file = self._file(stage, key)
+        with stage_trace.stage(f'cache:{stage}') as record:
+            try:
+                with open(file, 'rb') as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+                record['hit'] = False
+                return None
+            record['hit'] = True
+        os.utime(file) # LRU 순서 갱신
+        print(f'Stage [{stage}] loaded from cache.')
+        return value
+
+    def put(self, stage: str, key: str, value):
+        if not self.enabled:
+            return
+        file = self._file(stage, key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = file.with_name(f'{file.name}.{os.getpid()}.tmp')
+        try:
+            with open(temp_file, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, file)
+        except OSError as e:
+            print(f'Could not write cache file {file}: {e}')
+            return
+        self.evict()
+
+    def get_or_compute(self, stage: str, key: str, compute):
+        value = self.get(stage, key)
+        if value is None:
+            value = compute()
+            self.put(stage, key, value)
+        return value
+
+    def evict(self):
+        files = []
+        for file in self.root.glob('*/*.pkl'):
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+        total = sum(x[1] for x in files)
+        for _, size, file in sorted(files, key=lambda x: x[0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                file.unlink()
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,129 @@
+import sys
+import time
+import json
+import cProfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# 프로세스 최대 RSS (KB)
+def peak_rss_kb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+    if psutil is not None:
+        return psutil.Process().memory_info().peak_wset // 1024
+    return None
+
+
+# 단계별 wall/CPU 시간, 최대 RSS 증가량, 행 수 기록
+# profile_dir를 지정하면 최상위 단계마다 cProfile 결과를 <단계>.prof로 저장
+class Tracer:
+    def __init__(self, profile_dir: Path = None):
+        self.records = []
+        self.info = {}
+        self.profile_dir = profile_dir
+        self.started = datetime.now()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        depth = getattr(self._local, 'depth', 0)
+        record = {'name': name, 'depth': depth, **info}
+        parent = getattr(self._local, 'record', None)
+        profiler = None
+        if self.profile_dir is not None and depth == 0:
+            profiler = cProfile.Profile()
+        rss = peak_rss_kb()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        record['start_seconds'] = round(wall - self._start, 6)
+        self._local.depth = depth + 1
+        self._local.record = record
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self._local.depth = depth
+            self._local.record = parent
+            record['wall_seconds'] = round(time.perf_counter() - wall, 6)
+            record['cpu_seconds'] = round(time.process_time() - cpu, 6)
+            if rss is not None:
+                record['peak_rss_delta_kb'] = peak_rss_kb() - rss
+            with self._lock:
+                self.records.append(record)
+            if profiler is not None:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(self.profile_dir / f'{name}.prof')
+
+    def summary(self):
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'wall_seconds': round(time.perf_counter() - self._start, 6),
+            'peak_rss_kb': peak_rss_kb(),
+            **self.info,
+            'stages': sorted(self.records, key=lambda x: x['start_seconds'])
+        }
+
+    def write(self, file: Path):
+        with open(file, 'wt', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+        print(f'Wrote stage trace: {file}')
+
+
+_tracer = None # 현재 프로세스에서 실행 중인 run()의 tracer
+_tracer_lock = threading.Lock()
+
+
+def start(profile_dir: Path = None):
+    global _tracer
+    with _tracer_lock:
+        _tracer = Tracer(profile_dir)
+        return _tracer
+
+
+def finish():
+    global _tracer
+    with _tracer_lock:
+        tracer, _tracer = _tracer, None
+    return tracer
+
+
+# 현재 스레드에서 실행 중인 단계 기록에 값 추가
+def annotate(key: str, value):
+    tracer = _tracer
+    record = None if tracer is None else getattr(tracer._local, 'record', None)
+    if record is not None:
+        record[key] = value
+
+
+def set_info(key: str, value):
+    tracer = _tracer
+    if tracer is not None:
+        tracer.info[key] = value
+
+
+@contextmanager
+def stage(name: str, **info):
+    tracer = _tracer
+    if tracer is None:
+        yield info
+        return
+    with tracer.stage(name, **info) as record:
+        yield record
@@ -1,37 +1,108 @@
 from pathlib import Path
 import unittest
+import numpy as np
 import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
 import constants
+import blacklist_cache
+import file_processor
+import stage_trace
+import tier_rules
 import variants
+import workbook_writer
 from variants import Variant
 
 Col = constants.Col
 
 
 def read_blacklist(file: Path):
-    df = pd.read_excel(file, header=None)
-    df.columns = [Col.GENE_NAME, Col.AA_CHANGE, Col.NUCLEOTIDE_CHANGE]
-    # df.loc[len(df)] = ['MAMLD1', 'p.Ala565Ser', 'c.1693G>T'] 
-    return df
+    return blacklist_cache.load(file)
+
+
+oncomine_column_names = [
+    'FUNC1.gene', 'INFO.1.GENE_NAME', 'FUNC1.protein', 'FUNC1.coding', 
+    'INFO.A.AF', 'INFO.1.FDP', 'INFO.A.FAO', 'FUNC1.transcript', 
+    'FUNC1.function', 'FUNC1.oncomineGeneClass', 'FUNC1.oncomineVariantClass', 
+    'FUNC1.location', 'rowtype', 'INFO...OID', 'FUNC1.CLNID1', 
+    'FUNC1.CLNREVSTAT1', 'FUNC1.CLNSIG1', 'FUNC1.sift', 'FUNC1.polyphen', 
+    'FUNC1.grantham', 'INFO.1.FAIL_REASON', 'CHROM', 'POS', 'INFO.1.END', 
+    'FORMAT.1.CN', 'call', 'INFO...CI', 'ID', 'INFO...LEN', 'QUAL', 
+    'INFO...CDF_MAPD', 'ALT', 'INFO...READ_COUNT', 'INFO.1.EXON_NUM', 
+    'INFO.1.ANNOTATION', 'FILTER', 'Tier'
+]
+assert(len(constants.columns) == len(oncomine_column_names))
+
+# 읽을 때 dtype을 고정하는 칼럼
+# POS, READ_COUNT 등 정수 칼럼은 결측 여부에 따라 int/float가 달라지므로 타입 추론에 맡김
+oncomine_column_dtypes = {
+    'FUNC1.gene': 'object', 'INFO.1.GENE_NAME': 'object',
+    'FUNC1.protein': 'object', 'FUNC1.coding': 'object',
+    'INFO.A.AF': 'float64', 'INFO.1.FDP': 'float64', 'INFO.A.FAO': 'float64',
+    'FUNC1.transcript': 'object', 'FUNC1.function': 'object',
+    'FUNC1.oncomineGeneClass': 'object', 'FUNC1.oncomineVariantClass': 'object',
+    'FUNC1.location': 'category', 'rowtype': 'category',
+    'FUNC1.CLNREVSTAT1': 'object', 'FUNC1.CLNSIG1': 'object',
+    'INFO.1.FAIL_REASON': 'object', 'CHROM': 'object', 'FORMAT.1.CN': 'float64',
+    'call': 'category', 'INFO...CI': 'object', 'ID': 'object', 'QUAL': 'float64',
+    'INFO...CDF_MAPD': 'float64', 'ALT': 'object', 'INFO.1.ANNOTATION': 'object',
+    'FILTER': 'category'
+}
 
 
-def parse_oncomine_file(file: Path):
-    column_orig_names = [
-        'FUNC1.gene', 'INFO.1.GENE_NAME', 'FUNC1.protein', 'FUNC1.coding', 
-        'INFO.A.AF', 'INFO.1.FDP', 'INFO.A.FAO', 'FUNC1.transcript', 
-        'FUNC1.function', 'FUNC1.oncomineGeneClass', 'FUNC1.oncomineVariantClass', 
-        'FUNC1.location', 'rowtype', 'INFO...OID', 'FUNC1.CLNID1', 
-        'FUNC1.CLNREVSTAT1', 'FUNC1.CLNSIG1', 'FUNC1.sift', 'FUNC1.polyphen', 
-        'FUNC1.grantham', 'INFO.1.FAIL_REASON', 'CHROM', 'POS', 'INFO.1.END', 
-        'FORMAT.1.CN', 'call', 'INFO...CI', 'ID', 'INFO...LEN', 'QUAL', 
-        'INFO...CDF_MAPD', 'ALT', 'INFO...READ_COUNT', 'INFO.1.EXON_NUM', 
-        'INFO.1.ANNOTATION', 'FILTER', 'Tier'
-    ]
-    assert(len(constants.columns) == len(column_orig_names))
+def _count_comment_lines(f):
+    position = f.tell()
+    count = 0
+    for line in f:
+        if not line.startswith(b'#'):
+            break
+        count += 1
+    f.seek(position)
+    return count
+
+
+def _read_oncomine_table_arrow(file):
+    arrow_types = {'object': pa.string(), 'float64': pa.float64(),
+                   'category': pa.dictionary(pa.int32(), pa.string())}
+    convert_options = pa_csv.ConvertOptions(
+        include_columns=['vcf.rownum'] + oncomine_column_names,
+        include_missing_columns=True,
+        column_types={'vcf.rownum': pa.int64(),
+                      **{k: arrow_types[v] for k, v in oncomine_column_dtypes.items()}},
+        null_values=pa_csv.ConvertOptions().null_values + ['.', 'None', '<NA>'],
+        strings_can_be_null=True)
+    with file_processor.open_input(file) as f:
+        read_options = pa_csv.ReadOptions(skip_rows=_count_comment_lines(f))
+        table = pa_csv.read_csv(f, read_options=read_options,
+                                parse_options=pa_csv.ParseOptions(delimiter='\t'),
+                                convert_options=convert_options)
+    if table.num_rows == 0:
+        print('Data does not exist in current file: ' + str(file))
+        return pd.DataFrame(columns=oncomine_column_names)
+    missing_columns = [x.name for x in table.schema if pa.types.is_null(x.type)]
+    df = table.drop_columns(missing_columns).to_pandas()
+    return df.set_index('vcf.rownum')
+
 
+def _read_oncomine_table(file, engine):
+    if engine == 'pyarrow':
+        return _read_oncomine_table_arrow(file)
+    usecols = set(oncomine_column_names + ['vcf.rownum'])
+    with file_processor.open_input(file) as f:
+        return pd.read_table(f, index_col='vcf.rownum', comment='#',
+                             na_values=['.'], usecols=lambda x: x in usecols,
+                             dtype=oncomine_column_dtypes, engine=engine)
+
+
+def _read_oncomine_table_inferred(file):
+    column_orig_names = oncomine_column_names
     try:
-        df = pd.read_table(file, index_col='vcf.rownum', comment='#',
-                           na_values=['.'], low_memory=False)
+        with file_processor.open_input(file) as f:
+            df = pd.read_table(f, index_col='vcf.rownum', comment='#',
+                               na_values=['.'], low_memory=False)
         not_exist_columns = [x for x in column_orig_names if x not in df.columns.tolist()]
         not_exist_columns.remove('Tier')
         # print(f'Columns not in current tsv file: {not_exist_columns}')
@@ -39,29 +110,127 @@ def parse_oncomine_file(file: Path):
     except pd.errors.EmptyDataError:
         print('Data does not exist in current file: ' + str(file))
         df = pd.DataFrame(columns = column_orig_names)
-    df = df[[c for c in column_orig_names]]
-    df.columns = constants.columns
-    df[Col.TIER] = df[Col.TIER].apply(str)
     return df
 
 
-def generate_variants(D_df: pd.DataFrame, R_df: pd.DataFrame, blacklist: pd.DataFrame):
+# 어느 Variant 클래스의 call/nocall 조건에도 해당하지 않는 행은 보고서에 쓰이지 않음
+def _relevant_rows(df: pd.DataFrame) -> np.ndarray:
+    masks = variants.RowMasks(df)
+    relevant = np.zeros(len(df), dtype=bool)
+    for cls in (variants.SNV, variants.CNV, variants.Fusion):
+        relevant |= cls.call_mask(masks) | cls.nocall_mask(masks)
+    return relevant
+
+
+# 메모리 제한 모드: chunksize 행씩 읽으면서 필요한 행만 남김
+def _read_oncomine_table_chunked(file, chunksize: int):
+    usecols = set(oncomine_column_names + ['vcf.rownum'])
+    # chunk마다 category 목록이 달라지므로 합친 뒤에 category로 변환
+    dtypes = {k: 'object' if v == 'category' else v for k, v in oncomine_column_dtypes.items()}
+    chunks = []
+    try:
+        with file_processor.open_input(file) as f:
+            reader = pd.read_table(f, index_col='vcf.rownum', comment='#',
+                                   na_values=['.'], usecols=lambda x: x in usecols,
+                                   dtype=dtypes, chunksize=chunksize)
+            for chunk in reader:
+                chunk = chunk.reindex(columns=oncomine_column_names)
+                renamed = chunk.copy(deep=False)
+                renamed.columns = constants.columns
+                chunks.append(chunk[_relevant_rows(renamed)])
+    except pd.errors.EmptyDataError:
+        print('Data does not exist in current file: ' + str(file))
+    if not chunks:
+        return pd.DataFrame(columns=oncomine_column_names)
+    return pd.concat(chunks)
+
+
+# 메모리 제한 모드에서 정수형으로 줄이는 칼럼 (결측이 없을 때만)
+count_columns = [Col.TOTAL_DEPTH, Col.VARIANT_COUNT, Col.POSITION, Col.END_POSITION,
+                 Col.LENGTH, Col.TOTAL_READ, Col.EXON_NUMBER]
+
+
+def compact_dtypes(df: pd.DataFrame):
+    for name, dtype in oncomine_column_dtypes.items():
+        column = constants.columns[oncomine_column_names.index(name)]
+        if dtype == 'category' and df[column].dtype != 'category':
+            df[column] = df[column].astype('category')
+    for column in count_columns:
+        values = pd.to_numeric(df[column], errors='coerce')
+        if values.notna().all() and np.array_equal(values, np.floor(values)):
+            df[column] = pd.to_numeric(values, downcast='integer')
+    return df
+
+
+# engine: 'pyarrow'(설치된 경우 기본값), 'c', 또는 'inferred'(기존 방식)
+# chunksize: 지정하면 chunk 단위로 읽어 필요한 행만 남기고 dtype을 줄임 (메모리 제한 모드)
+def parse_oncomine_file(file: Path, engine: str = None, chunksize: int = None):
+    with stage_trace.stage('parse_oncomine_file', file=file.name) as record:
+        if engine is None:
+            engine = 'c' if pa_csv is None else 'pyarrow'
+
+        if chunksize is not None:
+            df = _read_oncomine_table_chunked(file, chunksize)
+        elif engine == 'inferred':
+            df = _read_oncomine_table_inferred(file)
+        else:
+            try:
+                df = _read_oncomine_table(file, engine)
+                df = df.reindex(columns=oncomine_column_names) #tsv 파일에 존재하지 않는 칼럼이 있을 경우 추가
+            except (ValueError, TypeError, KeyError) as e:
+                print(f'Could not parse with column schema ({e}), falling back to'
+                      f' type inference: {file}')
+                df = _read_oncomine_table_inferred(file)
+        df = df[[c for c in oncomine_column_names]]
+        df.columns = constants.columns
+        # oncomine 파일에는 tier 값이 없음, call 테이블은 Variant에서 tier 규칙으로 채움
+        df[Col.TIER] = pd.Categorical.from_codes(np.full(len(df), -1, dtype=np.int8),
+                                                 dtype=tier_rules.tier_dtype)
+        if chunksize is not None:
+            df = compact_dtypes(df)
+            record['memory_bytes'] = int(df.memory_usage(deep=True).sum())
+        record['rows'] = len(df)
+    return df
+
+
+def partition_rows(df: pd.DataFrame):
+    return variants.RowMasks(df)
+
+
+def _traced_variant(cls, df: pd.DataFrame, masks: variants.RowMasks):
+    with stage_trace.stage(cls.__qualname__) as record:
+        variant = cls(df, masks)
+        record['rows'] = len(variant.call)
+    return variant
+
+
+def generate_variants(D_df: pd.DataFrame, R_df: pd.DataFrame,
+                      blacklist: blacklist_cache.Blacklist,
+                      site_tier_rules: dict = None, annotation_index=None):
     variants.initialize_variant_blacklist(blacklist)
-    snv = variants.SNV(D_df)
-    cnv = variants.CNV(D_df)
+    variants.initialize_site_tier_rules(site_tier_rules)
+    variants.initialize_annotation_index(annotation_index)
+    D_masks = partition_rows(D_df)
+    snv = _traced_variant(variants.SNV, D_df, D_masks)
+    cnv = _traced_variant(variants.CNV, D_df, D_masks)
     if R_df is None:
-        fusion = variants.Fusion(D_df)
+        fusion = _traced_variant(variants.Fusion, D_df, D_masks)
     else:
-        fusion = variants.Fusion(R_df)
+        fusion = _traced_variant(variants.Fusion, R_df, partition_rows(R_df))
 
     return snv, cnv, fusion
 
 
-def write_dataframe_as_sheet(file, snv: Variant, cnv: Variant, fusion: Variant):
-    with pd.ExcelWriter(file, engine='xlsxwriter') as writer: # pylint: disable=abstract-class-instantiated
+# table_format: xlsx, 또는 csv/parquet (확장자를 뺀 이름의 폴더에 시트별 파일)
+def write_dataframe_as_sheet(file: Path, snv: Variant, cnv: Variant, fusion: Variant,
+                             table_format: str = 'xlsx'):
+    with stage_trace.stage('write_dataframe_as_sheet') as record, \
+            workbook_writer.open_writer(file, table_format) as writer:
         snv.print_worksheet(writer)
         cnv.print_worksheet(writer)
         fusion.print_worksheet(writer)
+        record['rows'] = sum(len(x.call) for x in (snv, cnv, fusion))
+    return file if table_format == 'xlsx' else file.with_suffix('')
 
 
 def filter_significant_tier(df: pd.DataFrame):
@@ -78,12 +247,10 @@ def generate_printable_gene_info(snv: Variant, cnv: Variant, fusion: Variant):
 
     mut_sig_genes = filter_significant_tier(mut)['Gene'].tolist()
     amp_sig_genes = filter_significant_tier(amp)['Gene'].tolist()
-    fus_sig_genes = []
-    if not fus.empty:
-        fus_sig_genes_column = filter_significant_tier(fus).apply(
-                lambda x: x['GeneA'] + '-' + x['GeneB'] + ' fusion', axis=1)
-        if not fus_sig_genes_column.empty:
-            fus_sig_genes = fus_sig_genes_column.tolist()
+    fus_sig = filter_significant_tier(fus)
+    # breakpoint가 하나인 행(MET exon 14 skipping 같은 RNAExonVariant)은 GeneB가 없음
+    fus_sig_genes = (fus_sig['GeneA'] + '-' + fus_sig['GeneB'] + ' fusion')\
+        .fillna(fus_sig['GeneA'] + ' exon skipping').tolist()
     sig_genes = list(set().union(mut_sig_genes, amp_sig_genes)) + list(set(fus_sig_genes)) #중복 제거
 
     return mut, amp, fus, sig_genes
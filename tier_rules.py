@@ -0,0 +1,144 @@
+import json
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from constants import Col, Tier, tier_ranks
+
+# tier 칼럼은 보고서 출력 전까지 순서 있는 categorical (int8 code)로 유지
+# 비교, 정렬, 최솟값은 code 연산으로 처리되고 문자열은 출력할 때만 사용
+tier_dtype = pd.CategoricalDtype(list(Tier), ordered=True)
+
+
+# conditions: (column, operator, value) 목록, 모두 만족하는 행에 tier 부여
+# operator: in, startswith, regex, contains(대소문자 무시), <, >=, min_length
+# final: 품질/benign/artifact 규칙처럼 annotation index로 덮어쓰지 않는 규칙
+class TierRule:
+    def __init__(self, tier: Tier, conditions: list, final: bool = False):
+        self.tier = tier
+        self.conditions = [tuple(x) for x in conditions]
+        self.final = final
+
+    @staticmethod
+    def from_dict(data: dict):
+        return TierRule(Tier(data['tier']), data['conditions'], data.get('final', False))
+
+    def __repr__(self):
+        return f'TierRule({self.tier}, {self.conditions}{", final" if self.final else ""})'
+
+
+def _as_strings(series: pd.Series):
+    # 값이 모두 NaN인 칼럼은 float로 읽혀 .str 접근이 불가
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.astype(object)
+    return series
+
+
+def _compile_condition(column, operator, value):
+    if operator == 'in':
+        values = list(value) if isinstance(value, (list, tuple)) else [value]
+        return lambda df: df[column].isin(values).to_numpy()
+    if operator == 'startswith':
+        prefixes = tuple(value) if isinstance(value, (list, tuple)) else value
+        return lambda df: _as_strings(df[column]).str.startswith(
+            prefixes, na=False).to_numpy(dtype=bool)
+    if operator == 'regex':
+        pattern = re.compile(value)
+        return lambda df: _as_strings(df[column]).str.contains(
+            pattern, na=False).to_numpy(dtype=bool)
+    if operator == 'contains':
+        keyword = value.lower()
+        return lambda df: _as_strings(df[column]).str.lower().str.contains(
+            keyword, regex=False, na=False).to_numpy(dtype=bool)
+    if operator == '<':
+        return lambda df: (df[column] < value).to_numpy()
+    if operator == '>=':
+        return lambda df: (df[column] >= value).to_numpy()
+    if operator == 'min_length':
+        return lambda df: (_as_strings(df[column]).str.len() >= value).to_numpy()
+    raise ValueError(f'Unknown tier rule operator: {operator}')
+
+
+# 뒤에 있는 규칙이 앞의 규칙보다 우선
+class CompiledRules:
+    def __init__(self, rules: list[TierRule]):
+        self.rules = rules
+        self._compiled = [(rule.tier, rule.final,
+                           [_compile_condition(*x) for x in rule.conditions])
+                          for rule in rules]
+
+    def apply(self, df: pd.DataFrame, default: Tier = Tier.TIER_NA):
+        return self.apply_with_final(df, default)[0]
+
+    # tier와 함께 final 규칙으로 tier가 정해진 행의 mask를 반환
+    def apply_with_final(self, df: pd.DataFrame, default: Tier = Tier.TIER_NA):
+        codes = np.full(len(df), tier_ranks[default], dtype=np.int8)
+        final = np.zeros(len(df), dtype=bool)
+        for tier, is_final, conditions in self._compiled:
+            mask = np.ones(len(df), dtype=bool)
+            for condition in conditions:
+                mask &= condition(df)
+            codes[mask] = tier_ranks[tier]
+            final[mask] = is_final
+        return pd.Categorical.from_codes(codes, dtype=tier_dtype), final
+
+
+default_rules = [
+    TierRule(Tier.TIER_3_4, [(Col.CLINICAL_SIGNIFICANCE, 'in',
+                              ['not_provided', 'Uncertain_significance'])]),
+    TierRule(Tier.TIER_3_4, [(Col.CLINICAL_SIGNIFICANCE, 'contains', 'conflicting')]),
+    TierRule(Tier.TIER_4, [(Col.CLINICAL_SIGNIFICANCE, 'contains', 'benign')], final=True),
+    TierRule(Tier.TIER_1_2, [(Col.HOTSPOT, 'in', ['Deleterious', 'Hotspot'])]),
+]
+
+cnv_tier_1_2_gene_names = [
+    'AKT1', 'ALK', 'BRAF', 'CCND2', 'CCNE1', 'CD274', 'CDK4', 'CDK6',
+    'DDR1', 'DDR2', 'EGFR', 'EMSY', 'ERBB2', 'FGF23', 'FGF3', 'FGF4',
+    'FGF19', 'CCND1', 'FGF9', 'FGFR1', 'FGFR2', 'FGFR4', 'GNAS', 'KRAS',
+    'MAP2K1', 'MCL1', 'MDM2', 'MET', 'MYC', 'NTRK1', 'PIK3CA', 'PTPN11',
+    'RAF1', 'RICTOR', 'ROS1', 'SRC'
+]
+
+fusion_tier_1_2_gene_names = [
+    'ALK', 'BRAF', 'MET', 'ESR1', 'EGFR', 'ETV6', 'NTRK3', 'FLI1',
+    'FGFR', 'FGFR3', 'NTRK2', 'NRG1', 'NTRK3', 'PAX8', 'RAF1', 'RELA',
+    'RET', 'PIK3CA'
+]
+
+builtin_rules = {
+    'SNV': default_rules + [
+        TierRule(Tier.TIER_3, [(Col.GENE_NAME, 'in', ['UGT1A1']),
+                               (Col.AA_CHANGE, 'in', ['p.Gly71Arg'])]),
+        TierRule(Tier.TIER_4, [(Col.TOTAL_DEPTH, '<', 500)], final=True),
+        TierRule(Tier.TIER_1, [(Col.GENE_NAME, 'in', ['EGFR']),
+                               (Col.AA_CHANGE, 'regex',
+                                r'p\.Glu746_.*del.*|p\.Leu747_.*del.*')]),
+        TierRule(Tier.TIER_BLACKLIST, [(Col.GENE_NAME, 'in', ['MAML3']),
+                                       (Col.NUCLEOTIDE_CHANGE, 'regex', r'c\.1455_.*del.*'),
+                                       (Col.NUCLEOTIDE_CHANGE, 'min_length', 16)],
+                       final=True),
+    ],
+    'CNV': default_rules + [
+        TierRule(Tier.TIER_1_2, [(Col.CALL, 'in', ['AMP']),
+                                 (Col.GENE_NAME, 'in', cnv_tier_1_2_gene_names)]),
+    ],
+    'Fusion': default_rules + [
+        TierRule(Tier.TIER_1_2, [(Col.GENE, 'startswith', fusion_tier_1_2_gene_names)]),
+    ],
+}
+
+
+# 기관별 추가 규칙 (blacklist.xlsx와 같은 위치의 tier_rules.json)
+# {"SNV": [{"tier": "III", "conditions": [["Gene_name", "in", ["TP53"]]]}], ...}
+# 내장 규칙 뒤에 추가되어 내장 규칙보다 우선, "final": true이면 annotation index보다도 우선
+def load_site_rules(file: Path):
+    with open(file, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    rules = {}
+    for variant_type, rule_list in data.items():
+        if variant_type not in builtin_rules:
+            raise ValueError(f'Unknown variant type in {file}: {variant_type}')
+        rules[variant_type] = [TierRule.from_dict(x) for x in rule_list]
+        CompiledRules(rules[variant_type]) # 잘못된 operator를 미리 확인
+    print(f'Loaded site tier rules: {file}')
+    return rules
@@ -1,18 +1,44 @@
+import io
 import re
+import gzip
 import unittest
 from pathlib import Path
 import pprint
 from ast import literal_eval
-import fitz
 import json
+import file_processor
+import stage_trace
 from constants import Metrics
 
 def read_pdf_as_text(file: Path):
-    with fitz.open(file) as doc:
+    import fitz # pylint: disable=import-outside-toplevel
+    with file_processor.open_input(file) as f:
+        data = f.read()
+    with fitz.open(stream=data, filetype='pdf') as doc:
         text = chr(12).join([page.get_text() for page in doc])
     return text
 
 
+coverage_header_tokens = ['Sample', 'Name', 'BarCode', 'Mapped', 'Reads',
+                          'On', 'Target', 'Mean', 'Depth', 'Uniformity']
+coverage_value_patterns = [re.compile(x) for x in
+                           (r'\d+', r'\d+.\d+%', r'[0-9]+(?:\.[0-9]+)?', r'\d+.\d+%')]
+
+
+def _to_coverage_metrics(matched):
+    mapped_reads = int(matched[0].replace(",", ""))
+    on_target = float(matched[1].strip("%"))
+    mean_depth = literal_eval(matched[2].replace(",", ""))
+    uniformity = float(matched[3].strip("%"))
+
+    return {
+        Metrics.MAPPED_READS: mapped_reads,
+        Metrics.ON_TARGET: on_target,
+        Metrics.MEAN_DEPTH: mean_depth,
+        Metrics.UNIFORMITY: uniformity
+    }
+
+
 def parse_coverage_metrics(text: str):
     pattern = re.compile(r'\bCoverage metrics\b[\s\S]+\b'\
                         r'Sample Name\s+'\
@@ -28,24 +54,92 @@ def parse_coverage_metrics(text: str):
                         r'([0-9]+(?:\.[0-9]+)?)\s+'\
                         r'(\d+.\d+%)\s+')
     match = pattern.search(text)
-    matched = match.groups()
-    mapped_reads = int(matched[0].replace(",", ""))
-    on_target = float(matched[1].strip("%"))
-    mean_depth = literal_eval(matched[2].replace(",", ""))
-    uniformity = float(matched[3].strip("%"))
-
-    coverage_metrics = {
-        Metrics.MAPPED_READS: mapped_reads,
-        Metrics.ON_TARGET: on_target,
-        Metrics.MEAN_DEPTH: mean_depth,
-        Metrics.UNIFORMITY: uniformity
-    }
+    coverage_metrics = _to_coverage_metrics(match.groups())
 
     print(f'Coverage metrics: \n{pprint.pformat(coverage_metrics)}')
 
     return coverage_metrics
 
 
+# 'Coverage metrics' 이후 단어 목록에서 표 헤더 다음의 Sample Name, BarCode를 건너뛰고 값 4개를 읽음
+# 표가 여러 개이면 parse_coverage_metrics의 정규식처럼 마지막 표를 사용
+def _parse_coverage_tokens(tokens: list[str]):
+    size = len(coverage_header_tokens)
+    for i in reversed(range(len(tokens) - size - 5)):
+        if tokens[i:i + size] != coverage_header_tokens:
+            continue
+        values = tokens[i + size + 2:i + size + 6]
+        if all(p.fullmatch(x) for p, x in zip(coverage_value_patterns, values)):
+            return _to_coverage_metrics(values)
+    return None
+
+
+def _find_coverage_metrics(doc):
+    tokens = []
+    for page in doc:
+        words = [x[4] for x in page.get_text('words')]
+        if not tokens:
+            start = next((i for i in range(len(words) - 1)
+                          if words[i] == 'Coverage' and words[i + 1] == 'metrics'), None)
+            if start is None:
+                continue
+            tokens = words[start:]
+        else:
+            tokens += words # 표가 다음 페이지로 이어지는 경우, 뒤쪽 표도 확인
+    return _parse_coverage_tokens(tokens)
+
+
+# 같은 pdf를 다시 열지 않는 것은 단계 캐시('qc')가 담당
+def read_coverage_metrics(file: Path):
+    import fitz # pylint: disable=import-outside-toplevel
+    with file_processor.open_input(file) as f:
+        data = f.read()
+    with stage_trace.stage('qc_pdf', bytes=len(data)) as record, \
+            fitz.open(stream=data, filetype='pdf') as doc:
+        record['pages'] = len(doc)
+        coverage_metrics = _find_coverage_metrics(doc)
+        if coverage_metrics is None:
+            text = chr(12).join([page.get_text() for page in doc])
+            return parse_coverage_metrics(text)
+
+    print(f'Coverage metrics: \n{pprint.pformat(coverage_metrics)}')
+    return coverage_metrics
+
+
+def _open_text(raw):
+    # .vcf.gz (bgzip 포함)은 gzip으로 읽음
+    magic = raw.read(2)
+    raw.seek(0)
+    if magic == b'\x1f\x8b':
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+# ##key=value 헤더를 dict로 반환 (같은 key가 여러 번 나오면 값 list)
+# #CHROM 줄 또는 keys가 모두 나오면 읽기 중단
+def read_vcf_headers(file: Path, keys: list[str] = None):
+    headers = {}
+    remaining = None if keys is None else set(keys)
+    with file_processor.open_input(file) as raw, _open_text(raw) as f:
+        for line in f:
+            if not line.startswith('##'):
+                break
+            key, separator, value = line[2:].strip().partition('=')
+            if not separator:
+                continue
+            if key not in headers:
+                headers[key] = value
+            elif isinstance(headers[key], list):
+                headers[key].append(value)
+            else:
+                headers[key] = [headers[key], value]
+            if remaining is not None:
+                remaining.discard(key)
+                if not remaining:
+                    break
+    return headers
+
+
 def parse_headers(file: Path):
     header_parameters = [
         Metrics.MSI_SCORE, Metrics.MSI_STATUS, Metrics.PERCENT_LOH,
@@ -56,18 +150,8 @@ def parse_headers(file: Path):
         Metrics.PERCENT_LOH: None
     }
     
-    with open(file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        for line in lines:
-            if line == '':
-                continue
-            if not line.startswith('##'):
-                break
-            match = re.match(r'##(\S+)=(\S+)', line)
-            if (match.group(1) in header_parameters):
-                result[match.group(1)] = match.group(2)
-            if len(result) == len(header_parameters):
-                break
+    headers = read_vcf_headers(file, header_parameters)
+    result.update({k: v for k, v in headers.items() if k in header_parameters})
     
     assert all(item in result.keys() for item in header_parameters), \
         'Could not parse header.'
@@ -76,7 +160,7 @@ def parse_headers(file: Path):
 
 
 def parse_tumor_fraction(file: Path):
-    with open(file) as json_file:
+    with file_processor.open_input(file) as json_file:
         json_data = json.load(json_file)
 
     metric = json_data['genomic_instability_metric']
@@ -103,6 +187,15 @@ class ReadTests(unittest.TestCase):
         self.assertIsNotNone(headers)
         print(headers)
 
+    def test_last_coverage_table(self):
+        header = 'Sample Name BarCode Mapped Reads On Target Mean Depth Uniformity'
+        text = (f'Coverage metrics\n{header}\nS1 IonCode_0101 1000 90.00% 100.5 91.00%\n'
+                f'{header}\nS1 IonCode_0101 2000 95.00% 200 96.00%\n')
+        expected = {Metrics.MAPPED_READS: 2000, Metrics.ON_TARGET: 95.0,
+                    Metrics.MEAN_DEPTH: 200, Metrics.UNIFORMITY: 96.0}
+        self.assertEqual(parse_coverage_metrics(text), expected)
+        self.assertEqual(_parse_coverage_tokens(text.split()), expected)
+
 
 if __name__ == '__main__':
     runner = unittest.TextTestRunner(verbosity=2)
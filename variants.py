@@ -1,29 +1,69 @@
+import threading
 from abc import ABC, abstractmethod
+import numpy as np
 import pandas as pd
 from constants import Col, Tier
-import re
+import tier_rules
 
 
-def initialize_variant_blacklist(df: pd.DataFrame):
-    Variant.blacklist = df
+def initialize_variant_blacklist(blacklist):
+    Variant.blacklist = blacklist
 
 
-class Variant(ABC):
-    blacklist = None
+def initialize_annotation_index(index):
+    Variant.annotation_index = index
+
+
+def initialize_site_tier_rules(rules: dict):
+    rules = rules or {}
+    if rules is not Variant.site_tier_rules:
+        Variant.site_tier_rules = rules
+        Variant._compiled_tier_rules = {}
 
+
+# oncomine 테이블의 칼럼별 조건 마스크를 한 번만 계산해 모든 Variant 클래스가 공유
+class RowMasks:
     def __init__(self, df: pd.DataFrame):
-        self._generate_data(df)
+        self.df = df
+        self._masks = {}
+
+    def isin(self, column, *values) -> np.ndarray:
+        key = ('isin', column, values)
+        if key not in self._masks:
+            self._masks[key] = self.df[column].isin(values).to_numpy()
+        return self._masks[key]
+
+    def notna(self, column) -> np.ndarray:
+        key = ('notna', column)
+        if key not in self._masks:
+            self._masks[key] = self.df[column].notna().to_numpy()
+        return self._masks[key]
+
+
+_nocall_lock = threading.Lock()
+
+
+class Variant(ABC):
+    blacklist = None
+    annotation_index = None # annotation_index.AnnotationIndex
+    site_tier_rules = {}
+    _compiled_tier_rules = {}
+
+    def __init__(self, df: pd.DataFrame, masks: RowMasks = None):
+        if masks is None:
+            masks = RowMasks(df)
+        self._generate_data(df, masks)
         self._assign_tier()
         self._sort()
-    
-    @property
+
+    @staticmethod
     @abstractmethod
-    def call_condition(self) -> str:
+    def call_mask(masks: RowMasks) -> np.ndarray:
         pass
 
-    @property
+    @staticmethod
     @abstractmethod
-    def nocall_condition(self) -> str:
+    def nocall_mask(masks: RowMasks) -> np.ndarray:
         pass
 
     @property
@@ -32,32 +72,49 @@ class Variant(ABC):
         pass
 
 
-    def _generate_data(self, df):
-        self.call = df.query(self.call_condition)[self.columns]
-        nocall_columns = [x for x in self.columns if x != Col.TIER]
-        self.nocall = df.query(self.nocall_condition)[nocall_columns]
+    def _generate_data(self, df, masks: RowMasks):
+        self.call = df.loc[self.call_mask(masks), self.columns]
+        # 보고서에는 call 테이블만 필요하므로 nocall 테이블은 처음 사용할 때 만듦
+        self._nocall_masks = masks
+        self._nocall = None
+
+
+    # cohort, workbook, cache_variants 단계가 여러 thread에서 동시에 읽으므로 한 번만 만듦
+    # (lock은 pickle되지 않도록 module 단위)
+    @property
+    def nocall(self) -> pd.DataFrame:
+        with _nocall_lock:
+            if self._nocall is None:
+                masks = self._nocall_masks
+                nocall_columns = [x for x in self.columns if x != Col.TIER]
+                self._nocall = masks.df.loc[self.nocall_mask(masks), nocall_columns]
+                self._nocall_masks = None
+        return self._nocall
+
+
+    # 단계 캐시 파일에 oncomine 전체 테이블이 들어가지 않도록 nocall을 만든 뒤 저장
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_nocall'] = self.nocall
+        state['_nocall_masks'] = None
+        return state
+
+
+    @classmethod
+    def compiled_tier_rules(cls) -> tier_rules.CompiledRules:
+        name = cls.__qualname__
+        if name not in Variant._compiled_tier_rules:
+            rules = tier_rules.builtin_rules[name] + Variant.site_tier_rules.get(name, [])
+            Variant._compiled_tier_rules[name] = tier_rules.CompiledRules(rules)
+        return Variant._compiled_tier_rules[name]
 
 
     def _assign_tier(self):
-        def populate_tier_default(row):
-            clinical_significance = row[Col.CLINICAL_SIGNIFICANCE]
-            hotspot = row[Col.HOTSPOT]
-
-            tier = Tier.TIER_NA
-            if pd.notna(clinical_significance):
-                if 'benign' in clinical_significance.lower():
-                    tier = Tier.TIER_4
-                elif clinical_significance == 'not_provided'\
-                    or clinical_significance == 'Uncertain_significance'\
-                    or 'conflicting' in clinical_significance.lower():
-                    tier = Tier.TIER_3_4
-            if pd.notna(hotspot):
-                if hotspot in ['Deleterious', 'Hotspot']:
-                    tier = Tier.TIER_1_2
-
-            return tier
-        
-        self.call[Col.TIER] = self.call.apply(populate_tier_default, axis=1)
+        tiers, final = self.compiled_tier_rules().apply_with_final(self.call)
+        if Variant.annotation_index is not None:
+            tiers = Variant.annotation_index.apply(self.__class__.__qualname__, self.call,
+                                                   tiers, final)
+        self.call[Col.TIER] = tiers
 
 
     
@@ -65,9 +122,15 @@ class Variant(ABC):
         Variant.sort_by_tier(self.call)
         
 
-    def print_worksheet(self, writer: pd.ExcelWriter):
-        self.call.to_excel(writer, sheet_name = self.__class__.__qualname__, index=False)
-        self.call.to_excel(writer, sheet_name = f'{self.__class__.__qualname__}_nocall', index=False)
+    # workbook_writer.add_sheet에 넘길 서식 (column_formats, hidden_rows, autofilter_column)
+    def _sheet_options(self, nocall: bool) -> dict:
+        return {}
+
+
+    def print_worksheet(self, writer):
+        name = self.__class__.__qualname__
+        writer.add_sheet(name, self.call, **self._sheet_options(False))
+        writer.add_sheet(f'{name}_nocall', self.nocall, **self._sheet_options(True))
 
 
     @abstractmethod
@@ -75,9 +138,15 @@ class Variant(ABC):
         pass
 
     
+    @staticmethod
+    def tier_as_categorical(df: pd.DataFrame):
+        if df[Col.TIER].dtype != tier_rules.tier_dtype:
+            df[Col.TIER] = df[Col.TIER].astype(tier_rules.tier_dtype)
+
+
     @staticmethod
     def sort_by_tier(df: pd.DataFrame):
-        df[Col.TIER] = pd.Categorical(df[Col.TIER], list(Tier), ordered=True)
+        Variant.tier_as_categorical(df)
         df.sort_values(by=Col.TIER, inplace=True)
     
 
@@ -101,61 +170,39 @@ class SNV(Variant):
         Col.REFSEQ, Col.REFSNP_ID, Col.REFSNP_STAT, Col.FAIL_REASON
     ]
 
-    call_condition = f'`{Col.CALL}` == "POS"'\
-        f' and `{Col.LOCATION}` not in ["intronic", "utr_3", "utr_5"]'\
-        f' and `{Col.ROWTYPE}` in ["snp", "del", "ins", "complex", "mnp", "RNAExonTiles"]'\
-        f' and `{Col.MUTATION_TYPE}`.notna()'\
-        f' and `{Col.MUTATION_TYPE}` != "synonymous"'
-    
-    nocall_condition = f'`{Col.CALL}` == "NOCALL"'\
-        f' and `{Col.ROWTYPE}` not in ["CNV", "Fusion"]'
+    @staticmethod
+    def call_mask(masks: RowMasks):
+        return masks.isin(Col.CALL, 'POS')\
+            & ~masks.isin(Col.LOCATION, 'intronic', 'utr_3', 'utr_5')\
+            & masks.isin(Col.ROWTYPE, 'snp', 'del', 'ins', 'complex', 'mnp', 'RNAExonTiles')\
+            & masks.notna(Col.MUTATION_TYPE)\
+            & ~masks.isin(Col.MUTATION_TYPE, 'synonymous')
+
+    @staticmethod
+    def nocall_mask(masks: RowMasks):
+        return masks.isin(Col.CALL, 'NOCALL')\
+            & ~masks.isin(Col.ROWTYPE, 'CNV', 'Fusion')
     
 
-    def __init__(self, df: pd.DataFrame):
-        super().__init__(df)
+    def __init__(self, df: pd.DataFrame, masks: RowMasks = None):
+        super().__init__(df, masks)
 
     
-    def _generate_data(self, df):
-        super()._generate_data(df)
+    def _generate_data(self, df, masks: RowMasks):
+        super()._generate_data(df, masks)
         self.call.loc[self.call[Col.AA_CHANGE].notna(),
                       Col.AA_CHANGE] = self.call[Col.AA_CHANGE].str.replace('Ter', '*')
     
 
     def _assign_tier(self):
         super()._assign_tier()
-        self.call.loc[(self.call[Col.GENE_NAME] == 'UGT1A1')
-            & (self.call[Col.AA_CHANGE] == 'p.Gly71Arg'), Col.TIER] = Tier.TIER_3
-
-        self.call.loc[self.call[Col.TOTAL_DEPTH] < 500, Col.TIER] = Tier.TIER_4
-
-        self.call.loc[(self.call[Col.GENE_NAME] == 'EGFR')
-            & ((self.call[Col.AA_CHANGE].str.contains(r'p\.Glu746_.*del.*', regex=True))
-                | (self.call[Col.AA_CHANGE].str.contains(r'p\.Leu747_.*del.*', regex=True))),
-            Col.TIER] = Tier.TIER_1
-
-        self.call.loc[(self.call[Col.GENE_NAME] == 'MAML3')
-            & (self.call[Col.NUCLEOTIDE_CHANGE].str.contains(r'c\.1455_.*del.*', regex=True)
-            & (self.call[Col.NUCLEOTIDE_CHANGE].str.len() >= 16)),
-            Col.TIER] = Tier.TIER_BLACKLIST
-
+        self.call.reset_index(drop=True, inplace=True)
         if Variant.blacklist is not None:
-            blacklist = Variant.blacklist
-            joined_df = self.call.merge(blacklist, how='left',
-                                        indicator='indicator_info')
-            joined_df.loc[joined_df['indicator_info'] == 'both', Col.TIER] = Tier.TIER_BLACKLIST
-            joined_df.drop(columns='indicator_info', inplace=True)
-            self.call = joined_df
+            self.call.loc[Variant.blacklist.matches(self.call), Col.TIER] = Tier.TIER_BLACKLIST
     
 
-    def print_worksheet(self, writer: pd.ExcelWriter):
-        super().print_worksheet(writer)
-        call_sheet = writer.sheets[self.__class__.__qualname__]
-        nocall_sheet = writer.sheets[f'{self.__class__.__qualname__}_nocall']
-
-        vaf_loc = self.call.columns.get_loc(Col.VAF)
-        percent_format = writer.book.add_format({'num_format': '0.0%'})
-        call_sheet.set_column(vaf_loc, vaf_loc, None, percent_format)
-        nocall_sheet.set_column(vaf_loc, vaf_loc, None, percent_format)
+    def _sheet_options(self, nocall: bool):
+        return {'column_formats': {Col.VAF: '0.0%'}}
     
     
     def generate_report_info(self):
@@ -176,52 +223,33 @@ class CNV(Variant):
         Col.HOTSPOT, Col.FAIL_REASON, Col.CLINICAL_SIGNIFICANCE
     ]
 
-    call_condition = f'(`{Col.CALL}` in ["DEL", "AMP"]'\
-        f' or `{Col.ROWTYPE}` == "LOH")'\
-        f' and `{Col.GENE_NAME}`.notna()'
-    
-    nocall_condition = f'`{Col.CALL}` == "NOCALL"'\
-        f' and `{Col.ROWTYPE}` in ["CNV", "LOH"]'
+    @staticmethod
+    def call_mask(masks: RowMasks):
+        return (masks.isin(Col.CALL, 'DEL', 'AMP') | masks.isin(Col.ROWTYPE, 'LOH'))\
+            & masks.notna(Col.GENE_NAME)
+
+    @staticmethod
+    def nocall_mask(masks: RowMasks):
+        return masks.isin(Col.CALL, 'NOCALL')\
+            & masks.isin(Col.ROWTYPE, 'CNV', 'LOH')
     
 
-    def __init__(self, df: pd.DataFrame):
-        super().__init__(df)
+    def __init__(self, df: pd.DataFrame, masks: RowMasks = None):
+        super().__init__(df, masks)
 
     
-    def _generate_data(self, df):
-        super()._generate_data(df)
+    def _generate_data(self, df, masks: RowMasks):
+        super()._generate_data(df, masks)
         df = self.call
         df.drop(df[(df[Col.CALL] == 'AMP') & (df[Col.COPY_NUMBER] < 4)].index,
                 inplace=True)
 
 
-    def _assign_tier(self):
-        tier_1_2_gene_names = [
-            'AKT1', 'ALK', 'BRAF', 'CCND2', 'CCNE1', 'CD274', 'CDK4', 'CDK6', 
-            'DDR1', 'DDR2', 'EGFR', 'EMSY', 'ERBB2', 'FGF23', 'FGF3', 'FGF4', 
-            'FGF19', 'CCND1', 'FGF9', 'FGFR1', 'FGFR2', 'FGFR4', 'GNAS', 'KRAS',
-            'MAP2K1', 'MCL1', 'MDM2', 'MET', 'MYC', 'NTRK1', 'PIK3CA', 'PTPN11',
-            'RAF1', 'RICTOR', 'ROS1', 'SRC'
-        ]
-        super()._assign_tier()
-        self.call.loc[(self.call[Col.CALL] == 'AMP')
-                & (self.call[Col.GENE_NAME].isin(tier_1_2_gene_names)),
-                Col.TIER] = Tier.TIER_1_2
-
-
-    def print_worksheet(self, writer: pd.ExcelWriter):
-        super().print_worksheet(writer)
-        worksheet = writer.sheets[self.__class__.__qualname__]
-        df = self.call.reset_index(drop=True)
-        size = len(df.index)
-        call_loc = df.columns.get_loc(Col.CALL)
-        worksheet.autofilter(0, call_loc, size, call_loc)
-        for index, row in df.iterrows():
-            call = row[Col.CALL]
-            if call == 'AMP':
-                pass
-            else:
-                worksheet.set_row(index + 1, None, None, {'hidden': True})
+    def _sheet_options(self, nocall: bool):
+        if nocall:
+            return {}
+        return {'hidden_rows': (self.call[Col.CALL] != 'AMP').to_numpy(),
+                'autofilter_column': Col.CALL}
     
 
     def generate_report_info(self):
@@ -240,32 +268,29 @@ class Fusion(Variant):
         Col.CLINICAL_SIGNIFICANCE
     ]
     
-    call_condition = f'`{Col.CALL}` == "POS"'\
-        f' and `{Col.ROWTYPE}` in ["Fusion", "RNAExonVariant"]'
-    
-    nocall_condition = f'{Col.FILTER} == "FAIL"'\
-        f' and `{Col.ROWTYPE}` in ["Fusion", "RNAExonVariant"]'
+    @staticmethod
+    def call_mask(masks: RowMasks):
+        return masks.isin(Col.CALL, 'POS')\
+            & masks.isin(Col.ROWTYPE, 'Fusion', 'RNAExonVariant')
+
+    @staticmethod
+    def nocall_mask(masks: RowMasks):
+        return masks.isin(Col.FILTER, 'FAIL')\
+            & masks.isin(Col.ROWTYPE, 'Fusion', 'RNAExonVariant')
     
 
-    def __init__(self, df: pd.DataFrame):
-        super().__init__(df)
+    def __init__(self, df: pd.DataFrame, masks: RowMasks = None):
+        super().__init__(df, masks)
 
 
     def _assign_tier(self):
         if self.call.empty:
             return #빈 테이블일 때 .str 처리 에러
-        tier_1_2_gene_names = (
-            'ALK', 'BRAF', 'MET', 'ESR1', 'EGFR', 'ETV6', 'NTRK3', 'FLI1',
-            'FGFR', 'FGFR3', 'NTRK2', 'NRG1', 'NTRK3', 'PAX8', 'RAF1', 'RELA',
-            'RET', 'PIK3CA'
-            )
         super()._assign_tier()
-        self.call.loc[self.call[Col.GENE].str.startswith(tier_1_2_gene_names),
-                      Col.TIER] = Tier.TIER_1_2
         
     
     def _sort(self):
-        self.call[Col.TIER] = pd.Categorical(self.call[Col.TIER], list(Tier), ordered=True)
+        Variant.tier_as_categorical(self.call)
         self.call.sort_values(by=[Col.TOTAL_READ, Col.TIER], ascending=[False, True], inplace=True)
     
 
@@ -274,21 +299,30 @@ class Fusion(Variant):
             return pd.DataFrame(columns=['GeneA', 'Chromosome:BreakpointA',
                                          'GeneB', 'Chromosome:BreakpointB',
                                          'Total Read', 'Tier'])
-        fus = self.call.assign(ChBr = lambda x:
-                        (x[Col.CHROMOSOME] + ':' + x[Col.POSITION].astype(str)))
-        fus = fus[[Col.GENE, 'ChBr', Col.TOTAL_READ, Col.TIER]]
-
-        fus = fus.groupby(Col.TOTAL_READ).agg({
-            Col.GENE: list, 'ChBr': list, Col.TIER: 'min'})
-        fus.sort_values(by=Col.TOTAL_READ, ascending=False, inplace=True)
-        fus = fus.apply(pd.Series.explode, axis=1)
-        fus.reset_index(inplace=True)
-        assert len(fus.columns) == 6, f'column number is not 6, {len(fus.columns)}.'
-
-        fus.columns = ['Total Read', 'GeneA', 'GeneB', 'ChBrA', 'ChBrB', 'Tier']
-        fus = fus[['GeneA', 'ChBrA', 'GeneB', 'ChBrB', 'Total Read', 'Tier']]
+        # 같은 fusion의 breakpoint 행은 ID가 '<fusion ID>_1', '<fusion ID>_2' 형식
+        fusion_id = self.call[Col.ID].str.replace(r'_\d+$', '', regex=True)
+        fusion_id = fusion_id.fillna('Total_Read:' + self.call[Col.TOTAL_READ].astype(str))
+        fus = self.call.assign(
+            ChBr=self.call[Col.CHROMOSOME] + ':' + self.call[Col.POSITION].astype(str),
+            FusionID=fusion_id)
+        fus = fus.sort_values(by=Col.ID, kind='stable')
+
+        breakpoint_no = fus.groupby('FusionID', sort=False).cumcount()
+        breakpoint_a = fus[breakpoint_no == 0].set_index('FusionID')
+        breakpoint_b = fus[breakpoint_no == 1].set_index('FusionID')
+        grouped = fus.groupby('FusionID', sort=False)
+        fus = pd.DataFrame({
+            'GeneA': breakpoint_a[Col.GENE],
+            'ChBrA': breakpoint_a['ChBr'],
+            'GeneB': breakpoint_b[Col.GENE],
+            'ChBrB': breakpoint_b['ChBr'],
+            'Total Read': grouped[Col.TOTAL_READ].max(),
+            'Tier': grouped[Col.TIER].min()
+        }, index=breakpoint_a.index)
+        fus.sort_values(by='Total Read', ascending=False, kind='stable', inplace=True)
+        fus.reset_index(drop=True, inplace=True)
+
         fus.rename(lambda x: x.replace('ChBr', 'Chromosome:Breakpoint'),
                 axis='columns', inplace=True)
         Variant.sort_by_tier(fus)
         return fus
-    
\ No newline at end of file
@@ -0,0 +1,170 @@
+import time
+import hashlib
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import file_processor
+from core import RunOptions, CACHE_DIR_NAME, _run_case, _is_fusion_file, _parse_case_name
+
+
+def file_digest(file: Path):
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 공유 폴더에 새로 생기는 케이스 zip을 주기적으로 확인해 처리
+# - 크기/수정 시각이 stable_polls번 연속 같고 zip central directory가 온전해야 처리
+# - R(fusion) zip은 D zip이 준비된 뒤 fusion_wait초까지 기다림
+# - D(+R) zip 내용 hash를 ledger에 기록해 같은 내용은 한 번만 처리
+# - 실패한 케이스는 failures에 따로 기록하고 backoff * 2^(실패 횟수 - 1)초 뒤에 재시도,
+#   max_attempts번 실패하면 더 이상 시도하지 않음 (zip을 다시 올리면 hash가 달라져 새로 처리)
+class FolderWatcher:
+    def __init__(self, watch_dir: Path, output_dir: Path, options: RunOptions = None,
+                 workers: int = None, poll_interval: float = 10, stable_polls: int = 2,
+                 fusion_wait: float = 600, backoff: float = 60, max_attempts: int = 3):
+        self.watch_dir = watch_dir
+        self.output_dir = output_dir
+        self.options = options or RunOptions()
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stable_polls = stable_polls
+        self.fusion_wait = fusion_wait
+        self.backoff = backoff
+        self.max_attempts = max_attempts
+        cache_dir = self.options.cache_dir or output_dir / CACHE_DIR_NAME
+        self.ledger_file = cache_dir / 'watch' / 'processed.json'
+        self.failures_file = cache_dir / 'watch' / 'failed.json'
+        self.ledger = file_processor.read_json(self.ledger_file) or {}
+        self.failures = file_processor.read_json(self.failures_file) or {}
+        self._seen = {} # {zip: ((size, mtime), 연속으로 같았던 횟수)}
+        self._digests = {} # {(zip, size, mtime): sha256}
+        self._ready_since = {} # {D zip: R zip 없이 준비된 시각}
+        self._running = {} # {future: (D zip, key)}
+
+    def _is_stable(self, file: Path):
+        try:
+            stat = file.stat()
+        except OSError:
+            return False
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        previous, count = self._seen.get(file, (None, 0))
+        count = count + 1 if stamp == previous else 0
+        self._seen[file] = (stamp, count)
+        return count >= self.stable_polls and zipfile.is_zipfile(file)
+
+    def _digest(self, file: Path):
+        stamp = self._seen[file][0]
+        if (file, *stamp) not in self._digests:
+            self._digests[(file, *stamp)] = file_digest(file)
+        return self._digests[(file, *stamp)]
+
+    # 상주 서비스에서 계속 커지지 않도록 폴더에서 사라졌거나 바뀐 zip의 기록은 지움
+    def _forget_removed(self, zips: set):
+        self._seen = {k: v for k, v in self._seen.items() if k in zips}
+        self._ready_since = {k: v for k, v in self._ready_since.items() if k in zips}
+        self._digests = {k: v for k, v in self._digests.items()
+                         if k[0] in zips and self._seen.get(k[0], (None,))[0] == k[1:]}
+
+    def _ready_cases(self):
+        zips = sorted(self.watch_dir.glob('*.zip'))
+        self._forget_removed(set(zips))
+        stable = {x for x in zips if self._is_stable(x)}
+        running = {x for x, _ in self._running.values()}
+        for source_file in zips:
+            if source_file not in stable or _is_fusion_file(source_file) \
+                    or source_file in running:
+                continue
+            case_name = _parse_case_name(source_file.stem)
+            fusion_file = file_processor.find_fusion_file(self.watch_dir, case_name)
+            if fusion_file is None:
+                since = self._ready_since.setdefault(source_file, time.monotonic())
+                if time.monotonic() - since < self.fusion_wait:
+                    continue
+            elif fusion_file not in stable:
+                continue
+            self._ready_since.pop(source_file, None)
+            key = self._digest(source_file)
+            if fusion_file is not None:
+                key += '+' + self._digest(fusion_file)
+            if key not in self.ledger and self._may_retry(key):
+                yield source_file, key
+
+    def _may_retry(self, key: str):
+        failure = self.failures.get(key)
+        return failure is None or (failure['attempts'] < self.max_attempts
+                                   and failure['not_before'] <= time.time())
+
+    def _record(self, source_file: Path, key: str, error):
+        case_name = _parse_case_name(source_file.stem)
+        now = datetime.now().isoformat(timespec='seconds')
+        if error is None:
+            self.ledger[key] = {'case': case_name, 'file': source_file.name, 'status': 'ok',
+                                'time': now}
+            file_processor.write_json_atomic(self.ledger_file, self.ledger)
+            if self.failures.pop(key, None) is not None:
+                file_processor.write_json_atomic(self.failures_file, self.failures)
+            print(f'[OK] {case_name}')
+            return
+        attempts = self.failures.get(key, {}).get('attempts', 0) + 1
+        self.failures[key] = {'case': case_name, 'file': source_file.name, 'attempts': attempts,
+                              'not_before': time.time() + self.backoff * 2 ** (attempts - 1),
+                              'error': error, 'time': now}
+        file_processor.write_json_atomic(self.failures_file, self.failures)
+        if attempts < self.max_attempts:
+            status = f'retry in {self.backoff * 2 ** (attempts - 1):.0f}s'
+        else:
+            status = f'giving up after {attempts} attempts'
+        print(f'[FAILED] {case_name} ({source_file}, {status})\n{error}')
+
+    # 작업 프로세스가 죽어 pool을 더 사용할 수 없으면 True
+    def _collect(self, timeout):
+        done, _ = wait(self._running, timeout=timeout, return_when=FIRST_COMPLETED)
+        crashed = []
+        for future in done:
+            source_file, key = self._running.pop(future)
+            try:
+                _, error = future.result()
+            except BrokenProcessPool:
+                crashed.append((source_file, key))
+                continue
+            except Exception as e: # pylint: disable=broad-exception-caught
+                error = repr(e)
+            self._record(source_file, key, error)
+        if not crashed:
+            return False
+        # 어느 케이스 때문인지 알 수 없으므로 실행 중이던 케이스 모두 실패로 기록해 재시도
+        for source_file, key in crashed + list(self._running.values()):
+            self._record(source_file, key, 'Worker process terminated abruptly'
+                         ' (killed or crashed)')
+        self._running.clear()
+        return True
+
+    def _serve(self, executor):
+        while True:
+            for source_file, key in self._ready_cases():
+                print(f'New case: {source_file.name}')
+                try:
+                    future = executor.submit(_run_case, source_file, self.output_dir,
+                                             self.options)
+                except BrokenProcessPool:
+                    return
+                self._running[future] = (source_file, key)
+            if self._running:
+                if self._collect(self.poll_interval):
+                    return
+            else:
+                time.sleep(self.poll_interval)
+
+    def run_forever(self):
+        print(f'Watching [{self.watch_dir}] every {self.poll_interval}s'
+              f' ({len(self.ledger)} cases already processed).')
+        while True:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                self._serve(executor)
+            print('A worker process died, restarting the process pool.')
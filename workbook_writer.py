@@ -0,0 +1,96 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xlsxwriter
+from constants import Tier, table_formats
+
+CHUNK_ROWS = 10000 # 결측값을 None으로 바꾸는 단위 (전체 테이블을 object로 복사하지 않도록)
+
+
+def _write_tier(worksheet, row, col, tier, cell_format=None):
+    return worksheet.write_string(row, col, str(tier), cell_format)
+
+
+# constant_memory 모드: 행 순서대로 한 번만 쓰고 바로 파일로 flush
+class XlsxTableWriter:
+    def __init__(self, file: Path):
+        self.file = file
+        self.book = xlsxwriter.Workbook(str(file), {'constant_memory': True})
+        # pandas to_excel의 기본 헤더 스타일
+        self.header_format = self.book.add_format(
+            {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        self._formats = {}
+
+    def _num_format(self, num_format: str):
+        if num_format not in self._formats:
+            self._formats[num_format] = self.book.add_format({'num_format': num_format})
+        return self._formats[num_format]
+
+    def add_sheet(self, name: str, df: pd.DataFrame, column_formats: dict = None,
+                  hidden_rows: np.ndarray = None, autofilter_column: str = None):
+        worksheet = self.book.add_worksheet(name)
+        worksheet.add_write_handler(Tier, _write_tier)
+        for column, num_format in (column_formats or {}).items():
+            loc = df.columns.get_loc(column)
+            worksheet.set_column(loc, loc, None, self._num_format(num_format))
+        if autofilter_column is not None:
+            loc = df.columns.get_loc(autofilter_column)
+            worksheet.autofilter(0, loc, len(df.index), loc)
+
+        worksheet.write_row(0, 0, df.columns.tolist(), self.header_format)
+        hidden = set() if hidden_rows is None else set(np.flatnonzero(hidden_rows) + 1)
+        row = 1
+        for start in range(0, len(df.index), CHUNK_ROWS):
+            chunk = df.iloc[start:start + CHUNK_ROWS]
+            values = chunk.astype(object).where(chunk.notna(), None)
+            for record in values.itertuples(index=False, name=None):
+                if row in hidden:
+                    worksheet.set_row(row, None, None, {'hidden': True})
+                worksheet.write_row(row, 0, record)
+                row += 1
+
+    def close(self):
+        self.book.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Excel을 사용하지 않는 자동화 파이프라인용: 시트마다 csv/parquet 파일 하나
+class TableDirectoryWriter:
+    def __init__(self, directory: Path, table_format: str):
+        self.directory = directory
+        self.table_format = table_format
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def add_sheet(self, name: str, df: pd.DataFrame, **_):
+        df = df.copy()
+        for column in df.columns:
+            if df[column].dtype == object or isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(object).where(
+                    df[column].isna(), df[column].astype(str))
+        file = self.directory / f'{name}.{self.table_format}'
+        if self.table_format == 'csv':
+            df.to_csv(file, index=False)
+        else:
+            df.to_parquet(file, index=False)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_writer(file: Path, table_format: str = 'xlsx'):
+    if table_format == 'xlsx':
+        return XlsxTableWriter(file)
+    if table_format in table_formats:
+        return TableDirectoryWriter(file.with_suffix(''), table_format)
+    raise ValueError(f'Unknown table format: {table_format}')